@@ -1,16 +1,154 @@
 import pygame
+import numpy as np
 import random
 import math
 import sys
+import time
+import argparse
+import struct
+import zlib
+import csv
+import json
+import os
+import multiprocessing
+import tracemalloc
+import threading
+import subprocess
+from collections import deque, Counter, namedtuple
 
-# Initialize pygame
-pygame.init()
-pygame.mixer.init()
+# Importing has no side effects: windowed games bring up the display, fonts
+# load on first use and nothing else (audio included) is ever initialized.
+# asyncio and shared_memory are imported by the co-op and capture code that
+# uses them, since each takes longer to import than everything else here
 
 # Game constants
 SCREEN_WIDTH = 1000
 SCREEN_HEIGHT = 700
-FPS = 60
+FPS = 60  # draw rate cap
+
+# Fixed-timestep simulation
+SIM_RATE = 60  # simulation ticks per second
+MAX_CATCH_UP = 5  # most ticks run for one drawn frame
+
+# Collision broad phase: "grid", "brute", or "auto" to use the grid only for
+# passes testing at least COLLISION_GRID_PAIRS pairs (building the grid costs
+# more than it saves below about that, which covers most of a normal game)
+COLLISION_MODES = ("auto", "grid", "brute")
+COLLISION_MODE = "auto"
+COLLISION_GRID_PAIRS = 400
+COLLISION_CELL_SIZE = 64
+
+# Particle engine capacity (live particles)
+MAX_PARTICLES = 50000
+
+# Enemy bullet engine capacity (live bullets) and boss volley size
+MAX_ENEMY_BULLETS = 20000
+BOSS_RING_BULLETS = 12
+
+# Background stars, baked into one scrolling layer per speed band
+STAR_COUNT = 200
+STAR_LAYERS = 3
+STAR_MIN_SPEED = 0.1
+STAR_MAX_SPEED = 0.5
+
+# Most distinct entity images kept pre-rendered
+SPRITE_CACHE_SIZE = 256
+
+# Timer wheel slots; deadlines further out wait a lap in their slot
+TIMER_WHEEL_SLOTS = 256
+
+# Dirty-rect rendering: past this share of the screen, flip everything instead
+DIRTY_RECT_THRESHOLD = 0.5
+
+# Frames of history behind the profiler's percentiles
+PROFILE_WINDOW = 300
+
+# Quality governor (see QualityGovernor): a level is dropped once the average
+# work per frame over the window passes GOVERNOR_HIGH of the budget, and
+# raised only after GOVERNOR_RAISE_FRAMES frames in a row under GOVERNOR_LOW
+GOVERNOR_WINDOW = 30
+GOVERNOR_HIGH = 0.9
+GOVERNOR_LOW = 0.5
+GOVERNOR_RAISE_FRAMES = 180
+GOVERNOR_HISTORY = 20
+
+# Cosmetic quality levels, best first. Particle bursts and lifetimes are
+# scaled, star layers are drawn brightest first, HUD text is refreshed every
+# hud_every frames and boss health bars can be dropped
+QualityLevel = namedtuple("QualityLevel", "name particles particle_life star_layers hud_every health_bars")
+QUALITY_LEVELS = [
+    QualityLevel("high", 1.0, 1.0, STAR_LAYERS, 1, True),
+    QualityLevel("medium", 0.6, 0.75, 2, 2, True),
+    QualityLevel("low", 0.3, 0.5, 1, 4, False),
+    QualityLevel("minimal", 0.1, 0.35, 0, 10, False),
+]
+QUALITY_NAMES = [level.name for level in QUALITY_LEVELS]
+
+# Benchmark suite (see run_bench)
+BENCH_FRAMES = 300
+BENCH_WARMUP = 60
+BENCH_REPEAT = 3  # best of this many runs is reported
+BENCH_THRESHOLD = 10.0  # percent FPS drop reported as a regression
+
+# Self-checks (see run_check), played by the autopilot
+CHECK_SEEDS = (0, 1, 2)
+CHECK_FRAMES = 15000  # cap per game; autopilot games end well before it
+CHECK_SNAPSHOT_AT = 3000  # frame the snapshot check saves at
+# Final (frame, score, wave) per check seed as played with per-frame
+# countdowns, before the timer wheel replaced them
+CHECK_EXPECTED = {0: (5118, 2405, 7), 1: (6510, 2750, 8), 2: (5660, 2685, 7)}
+
+# Batch runner (see run_batch)
+BATCH_MAX_FRAMES = 60 * 60 * 10  # games still going after 10 minutes are cut off
+BATCH_SUMMARY_EVERY = 100  # games between rewrites of the summary file
+
+# Training environments (see VectorEnv). An observation is the player state
+# followed by the nearest enemies and enemy bullets
+OBS_ENEMIES = 8
+OBS_BULLETS = 16
+OBS_PLAYER_SIZE = 6
+OBS_ENEMY_SIZE = 5
+OBS_BULLET_SIZE = 5
+OBS_SIZE = OBS_PLAYER_SIZE + OBS_ENEMIES * OBS_ENEMY_SIZE + OBS_BULLETS * OBS_BULLET_SIZE
+ACTION_COUNT = 64  # actions are input bitmasks, 0 to 63
+DEATH_PENALTY = 100  # reward lost per life
+
+# Pixel observations (see PixelObserver)
+PIXEL_OBS_WIDTH = 100
+PIXEL_OBS_HEIGHT = 70
+LUMA_WEIGHTS = np.array([77, 150, 29], dtype=np.uint16)  # RGB to gray, sums to 256
+
+# Co-op over a socket (serve, join, coop-bots)
+COOP_PLAYERS = 2
+NET_PORT = 47800
+NET_MAGIC = b"GDNP"
+NET_VERSION = 1
+NET_SEND_EVERY = 2  # ticks per snapshot, 30 a second at SIM_RATE
+NET_HISTORY = 64  # snapshots kept as delta bases
+NET_POSITION_SCALE = 4  # positions go out in quarter pixels
+NET_ZLIB_LEVEL = 6
+NET_INTERP_DELAY = 0.1  # seconds clients draw behind the server
+NET_BUDGET = 16 * 1024  # snapshot bytes per second per client to stay under
+NET_MAX_BUFFER = 256 * 1024  # unsent bytes at which a client's snapshots are skipped
+NET_RESTART_DELAY = 3.0  # seconds a finished co-op game shows before starting over
+NET_METRIC_WINDOW = 300  # samples behind each lag average
+NET_REPORT_EVERY = 10.0  # seconds between server reports
+
+# Gameplay capture (--capture)
+CAPTURE_SCALE = 0.5  # of the drawn frame
+CAPTURE_EVERY = 2  # presented frames per captured one
+CAPTURE_SLOTS = 32  # frames the shared ring holds for the encoder
+CAPTURE_CLIP_SECONDS = 30  # kept for the save-clip hotkey
+CAPTURE_ZLIB_LEVEL = 1
+CAPTURE_STOP_TIMEOUT = 10.0  # seconds close() waits for the encoder
+
+# Per-frame input actions (bitmask)
+ACTION_LEFT = 1
+ACTION_RIGHT = 2
+ACTION_UP = 4
+ACTION_DOWN = 8
+ACTION_FIRE = 16  # auto-fire while held
+ACTION_SHOT = 32  # single shot
 
 # Colors
 BLACK = (0, 0, 0)
@@ -22,336 +160,645 @@ YELLOW = (255, 255, 0)
 PURPLE = (180, 0, 255)
 CYAN = (0, 255, 255)
 ORANGE = (255, 165, 0)
+COLORKEY = (255, 0, 255)  # transparent pixels in cached sprites
+PLAYER_COLORS = [CYAN, (255, 120, 200), (255, 220, 120), (160, 160, 255)]  # by seat
+
+# Entity type descriptors, shared by every entity of a type. Spawn weights
+# are relative; min_speed == max_speed means a fixed speed with no random draw
+EnemyType = namedtuple("EnemyType", "width height color max_health score_value "
+                                    "shoot_delay min_speed max_speed spawn_weight")
+ENEMY_TYPES = {
+    "basic": EnemyType(40, 40, RED, 20, 10, 120, 1.0, 3.0, 0.5),
+    "fast": EnemyType(30, 30, PURPLE, 15, 15, 90, 3.0, 5.0, 0.3),
+    "tank": EnemyType(60, 60, ORANGE, 60, 30, 60, 0.5, 1.5, 0.2),
+    "boss": EnemyType(120, 120, (200, 0, 0), 300, 500, 30, 1.0, 1.0, 0),  # every 5th wave
+}
+SPAWN_TYPES = [name for name, kind in ENEMY_TYPES.items() if kind.spawn_weight]
+SPAWN_WEIGHTS = [ENEMY_TYPES[name].spawn_weight for name in SPAWN_TYPES]
+
+BulletType = namedtuple("BulletType", "width height color damage")
+ENEMY_BULLET_TYPES = {
+    "basic": BulletType(6, 12, RED, 10),
+    "fast": BulletType(6, 12, RED, 10),
+    "tank": BulletType(6, 12, RED, 10),
+    "boss": BulletType(8, 8, PURPLE, 20),
+}
+
+PowerUpType = namedtuple("PowerUpType", "color drop_weight")
+POWERUP_TYPES = {
+    "health": PowerUpType(GREEN, 0.4),
+    "weapon": PowerUpType(YELLOW, 0.3),
+    "shield": PowerUpType(BLUE, 0.2),
+    "laser": PowerUpType(ORANGE, 0.1),
+}
+DROP_TYPES = list(POWERUP_TYPES)
+ENEMY_TYPE_NAMES = list(ENEMY_TYPES)  # type ids in snapshots
+POWERUP_TYPE_NAMES = list(POWERUP_TYPES)
+DROP_WEIGHTS = [kind.drop_weight for kind in POWERUP_TYPES.values()]
+
+def load_font(size):
+    # Fonts load once per process and are shared by every game, until
+    # pygame quits
+    if not pygame.font.get_init():
+        FONTS.clear()
+        pygame.font.init()
+    font = FONTS.get(size)
+    if font is None:
+        font = FONTS[size] = pygame.font.Font(None, size)
+    return font
+
+FONTS = {}
+
+def quit_pygame():
+    # The shared fonts and display-format sprites die with pygame, so the
+    # next game in this process builds them again
+    FONTS.clear()
+    SPRITE_CACHES.clear()
+    pygame.quit()
+
+def initialized_subsystems():
+    return [name for name, module in (("pygame", pygame), ("display", pygame.display),
+                                      ("font", pygame.font), ("mixer", pygame.mixer),
+                                      ("joystick", pygame.joystick))
+            if module.get_init()]
+
+def new_sprite(width, height):
+    sprite = pygame.Surface((width, height))
+    sprite.fill(COLORKEY)
+    return sprite
+
+def finish_sprite(sprite):
+    # Match the display format when there is one, then key out the background
+    if pygame.display.get_surface() is not None:
+        sprite = sprite.convert()
+    sprite.set_colorkey(COLORKEY, pygame.RLEACCEL)
+    return sprite
+
+def blit_batch(screen, batch, rects=None):
+    # One Surface.blits call; with a rects list, the covered areas go into it
+    if rects is None:
+        screen.blits(batch, doreturn=False)
+    else:
+        rects.extend(screen.blits(batch))
+
+def scale_shapes(shapes, scale):
+    # (color, rect) shapes from logical coordinates to canvas pixels
+    if scale == 1:
+        return shapes
+    return [(color, (x * scale, y * scale, w * scale, h * scale)) for color, (x, y, w, h) in shapes]
+
+def fill_shapes(screen, shapes, rects=None):
+    # (color, rect) pairs such as health bars and laser beams
+    for color, shape in shapes:
+        rect = pygame.draw.rect(screen, color, shape)
+        if rects is not None:
+            rects.append(rect)
 
 class Player:
-    def __init__(self):
+    __slots__ = ("timers", "width", "height", "x", "y", "prev_x", "prev_y", "speed", "color",
+                 "health", "max_health", "shoot_ready", "shoot_delay", "power_level",
+                 "power_until", "score", "lives", "invincible_until", "weapon_type", "special_ammo")
+    sprite_offset = (0, 0)
+    STATE = struct.Struct("<4d9iqB")
+    
+    def __init__(self, timers, seat=0):
+        # Cooldown, power-up and invincibility are frames on the game's
+        # TimerWheel clock. Co-op partners (seat 1 up) start further left
+        # in their own color
+        self.timers = timers
         self.width = 50
         self.height = 40
-        self.x = SCREEN_WIDTH // 2
+        self.x = SCREEN_WIDTH // 2 - 150 * seat
         self.y = SCREEN_HEIGHT - 100
+        self.prev_x = self.x
+        self.prev_y = self.y
         self.speed = 8
-        self.color = CYAN
+        self.color = PLAYER_COLORS[seat]
         self.health = 100
         self.max_health = 100
-        self.shoot_cooldown = 0
+        self.shoot_ready = 0
         self.shoot_delay = 10
         self.power_level = 1
-        self.power_time = 0
+        self.power_until = 0
         self.score = 0
         self.lives = 3
-        self.invincible = 0
+        self.invincible_until = 0
         self.weapon_type = "normal"
         self.special_ammo = 0
         
-    def move(self, keys):
-        if keys[pygame.K_LEFT] and self.x > 0:
-            self.x -= self.speed
-        if keys[pygame.K_RIGHT] and self.x < SCREEN_WIDTH - self.width:
-            self.x += self.speed
-        if keys[pygame.K_UP] and self.y > 0:
-            self.y -= self.speed
-        if keys[pygame.K_DOWN] and self.y < SCREEN_HEIGHT - self.height:
-            self.y += self.speed
+    def state(self):
+        return (self.x, self.y, self.prev_x, self.prev_y, self.health, self.max_health,
+                self.shoot_ready, self.shoot_delay, self.power_level, self.power_until,
+                self.lives, self.invincible_until, self.special_ammo, self.score,
+                self.weapon_type == "laser")
+                
+    def set_state(self, values):
+        (self.x, self.y, self.prev_x, self.prev_y, self.health, self.max_health,
+         self.shoot_ready, self.shoot_delay, self.power_level, self.power_until,
+         self.lives, self.invincible_until, self.special_ammo, self.score, laser) = values
+        self.weapon_type = "laser" if laser else "normal"
+        
+    def move(self, actions):
+        speed = self.speed * self.timers.step
+        if actions & ACTION_LEFT and self.x > 0:
+            self.x -= speed
+        if actions & ACTION_RIGHT and self.x < SCREEN_WIDTH - self.width:
+            self.x += speed
+        if actions & ACTION_UP and self.y > 0:
+            self.y -= speed
+        if actions & ACTION_DOWN and self.y < SCREEN_HEIGHT - self.height:
+            self.y += speed
             
     def shoot(self, bullets):
-        if self.shoot_cooldown <= 0:
+        if self.shoot_ready <= self.timers.now:
             if self.weapon_type == "normal":
-                bullets.append(Bullet(self.x + self.width//2 - 2, self.y, -10, GREEN))
+                bullets.spawn(Bullet, self.x + self.width//2 - 2, self.y, -10, GREEN)
                 if self.power_level >= 2:
-                    bullets.append(Bullet(self.x + 10, self.y, -10, GREEN))
-                    bullets.append(Bullet(self.x + self.width - 15, self.y, -10, GREEN))
+                    bullets.spawn(Bullet, self.x + 10, self.y, -10, GREEN)
+                    bullets.spawn(Bullet, self.x + self.width - 15, self.y, -10, GREEN)
                 if self.power_level >= 3:
-                    bullets.append(Bullet(self.x + 5, self.y + 10, -10, GREEN, angle=-5))
-                    bullets.append(Bullet(self.x + self.width - 10, self.y + 10, -10, GREEN, angle=5))
+                    bullets.spawn(Bullet, self.x + 5, self.y + 10, -10, GREEN, -5)
+                    bullets.spawn(Bullet, self.x + self.width - 10, self.y + 10, -10, GREEN, 5)
             elif self.weapon_type == "laser":
-                bullets.append(LaserBeam(self.x + self.width//2 - 2, self.y))
+                bullets.spawn(LaserBeam, self.x + self.width//2 - 2, self.y, self.timers.ticks(10))
                 self.special_ammo -= 1
                 if self.special_ammo <= 0:
                     self.weapon_type = "normal"
                     
-            self.shoot_cooldown = self.shoot_delay
+            self.shoot_ready = self.timers.now + self.timers.ticks(self.shoot_delay)
             
-    def update(self):
-        if self.shoot_cooldown > 0:
-            self.shoot_cooldown -= 1
-        if self.power_time > 0:
-            self.power_time -= 1
-            if self.power_time == 0:
-                self.power_level = max(1, self.power_level - 1)
-        if self.invincible > 0:
-            self.invincible -= 1
-            
-    def draw(self, screen):
-        # Draw ship with invincibility blink
+    def power_down(self):
+        # The weapon power-up ran out
+        self.power_level = max(1, self.power_level - 1)
+        
+    @property
+    def power_time(self):
+        # Game frames left on the weapon power-up
+        return self.timers.frames(max(0, self.power_until - self.timers.now))
+        
+    @property
+    def invincible(self):
+        return self.timers.frames(max(0, self.invincible_until - self.timers.now))
+        
+    def sprite_key(self):
+        return ("player", self.color)
+        
+    def render_sprite(self):
+        sprite = new_sprite(self.width, self.height)
+        # Main body
+        pygame.draw.polygon(sprite, self.color, [
+            (self.width//2, 0),
+            (0, self.height),
+            (self.width, self.height)
+        ])
+        # Cockpit
+        pygame.draw.rect(sprite, BLUE, (self.width//2 - 10, 10, 20, 15))
+        # Engines
+        pygame.draw.rect(sprite, ORANGE, (10, self.height - 10, 10, 10))
+        pygame.draw.rect(sprite, ORANGE, (self.width - 20, self.height - 10, 10, 10))
+        return sprite
+            
+    def frame_parts(self, sprites):
+        # Ship blit (none while blinking from invincibility) and health bar,
+        # at the scale of the sprite cache
+        scale = sprites.scale
+        batch = []
         if self.invincible <= 0 or self.invincible % 8 < 4:
-            # Main body
-            pygame.draw.polygon(screen, self.color, [
-                (self.x + self.width//2, self.y),
-                (self.x, self.y + self.height),
-                (self.x + self.width, self.y + self.height)
-            ])
-            # Cockpit
-            pygame.draw.rect(screen, BLUE, 
-                            (self.x + self.width//2 - 10, self.y + 10, 20, 15))
-            # Engines
-            pygame.draw.rect(screen, ORANGE, 
-                            (self.x + 10, self.y + self.height - 10, 10, 10))
-            pygame.draw.rect(screen, ORANGE, 
-                            (self.x + self.width - 20, self.y + self.height - 10, 10, 10))
+            batch.append((sprites.get(self), (self.x * scale, self.y * scale)))
             
         # Health bar
         bar_width = 100
         bar_height = 10
         health_ratio = self.health / self.max_health
-        pygame.draw.rect(screen, RED, (self.x + self.width//2 - bar_width//2, 
-                                      self.y - 20, bar_width, bar_height))
-        pygame.draw.rect(screen, GREEN, (self.x + self.width//2 - bar_width//2, 
-                                        self.y - 20, bar_width * health_ratio, bar_height))
+        bar_x = self.x + self.width//2 - bar_width//2
+        bars = [(RED, (bar_x, self.y - 20, bar_width, bar_height)),
+                (GREEN, (bar_x, self.y - 20, bar_width * health_ratio, bar_height))]
+        return batch, scale_shapes(bars, scale)
         
     def take_damage(self, amount):
         if self.invincible <= 0:
             self.health -= amount
-            self.invincible = 60  # 1 second invincibility
+            self.invincible_until = self.timers.now + self.timers.ticks(60)  # 1 second invincibility
             return True
         return False
 
 class Bullet:
+    __slots__ = ("alive", "serial", "x", "y", "prev_x", "prev_y", "speed", "color", "angle")
+    sprite_offset = (0, 0)
+    width = 4
+    height = 10
+    damage = 10
+    STATE = struct.Struct("<6d3B")
+    
     def __init__(self, x, y, speed, color, angle=0):
+        self.reset(x, y, speed, color, angle)
+        
+    def reset(self, x, y, speed, color, angle=0):
+        self.alive = True
         self.x = x
         self.y = y
+        self.prev_x = x
+        self.prev_y = y
         self.speed = speed
         self.color = color
-        self.width = 4
-        self.height = 10
         self.angle = angle
-        self.damage = 10
         
-    def update(self):
-        self.y += self.speed
+    def state(self):
+        return (self.x, self.y, self.prev_x, self.prev_y, self.speed, self.angle) + tuple(self.color)
+        
+    def set_state(self, values):
+        self.alive = True
+        self.x, self.y, self.prev_x, self.prev_y, self.speed, self.angle = values[:6]
+        self.color = values[6:]
+        
+    def update(self, step=1):
+        self.y += self.speed * step
         if self.angle != 0:
-            self.x += self.angle
+            self.x += self.angle * step
         
-    def draw(self, screen):
-        pygame.draw.rect(screen, self.color, (self.x, self.y, self.width, self.height))
+    def sprite_key(self):
+        return ("bullet", self.color, self.width, self.height)
+        
+    def render_sprite(self):
+        sprite = new_sprite(self.width, self.height)
+        sprite.fill(self.color)
+        return sprite
         
     def is_off_screen(self):
         return self.y < -self.height or self.y > SCREEN_HEIGHT or self.x < 0 or self.x > SCREEN_WIDTH
 
 class LaserBeam:
-    def __init__(self, x, y):
+    __slots__ = ("alive", "serial", "x", "y", "prev_x", "prev_y", "lifetime")
+    width = 8
+    height = SCREEN_HEIGHT
+    damage = 5
+    STATE = struct.Struct("<4di")
+    
+    def __init__(self, x, y, lifetime=10):
+        self.reset(x, y, lifetime)
+        
+    def reset(self, x, y, lifetime=10):
+        self.alive = True
         self.x = x
         self.y = y
-        self.width = 8
-        self.height = SCREEN_HEIGHT
-        self.damage = 5
-        self.lifetime = 10
+        self.prev_x = x
+        self.prev_y = y
+        self.lifetime = lifetime  # ticks
         
-    def update(self):
+    def state(self):
+        return (self.x, self.y, self.prev_x, self.prev_y, self.lifetime)
+        
+    def set_state(self, values):
+        self.alive = True
+        self.x, self.y, self.prev_x, self.prev_y, self.lifetime = values
+        
+    def update(self, step=1):
         self.lifetime -= 1
         
-    def draw(self, screen):
+    def sprite_key(self):
+        return None  # length follows the ship, so drawn directly
+        
+    def shape(self):
         if self.lifetime > 0:
-            pygame.draw.rect(screen, YELLOW, (self.x, 0, self.width, self.y))
+            return (YELLOW, (self.x, 0, self.width, self.y))
             
     def is_active(self):
         return self.lifetime > 0
 
 class Enemy:
-    def __init__(self, enemy_type="basic"):
+    __slots__ = ("alive", "serial", "type", "kind", "rng", "timers", "x", "y", "prev_x", "prev_y",
+                 "width", "height", "speed", "next_shot", "health", "flash_until", "pattern_timer")
+    sprite_offset = (0, 0)
+    STATE = struct.Struct("<B5d4i")
+    
+    def __init__(self, enemy_type, rng, timers):
+        self.reset(enemy_type, rng, timers)
+        
+    def reset(self, enemy_type, rng, timers):
+        kind = ENEMY_TYPES[enemy_type]
+        self.alive = True
         self.type = enemy_type
-        self.setup_enemy()
-        self.x = random.randint(0, SCREEN_WIDTH - self.width)
-        self.y = random.randint(-100, -40)
-        self.shoot_timer = random.randint(30, 180)
-        self.health = self.max_health
-        self.hit_timer = 0
-        
-    def setup_enemy(self):
-        if self.type == "basic":
-            self.width = 40
-            self.height = 40
-            self.speed = random.uniform(1.0, 3.0)
-            self.color = RED
-            self.max_health = 20
-            self.score_value = 10
-            self.shoot_delay = 120
-        elif self.type == "fast":
-            self.width = 30
-            self.height = 30
-            self.speed = random.uniform(3.0, 5.0)
-            self.color = PURPLE
-            self.max_health = 15
-            self.score_value = 15
-            self.shoot_delay = 90
-        elif self.type == "tank":
-            self.width = 60
-            self.height = 60
-            self.speed = random.uniform(0.5, 1.5)
-            self.color = ORANGE
-            self.max_health = 60
-            self.score_value = 30
-            self.shoot_delay = 60
-        elif self.type == "boss":
-            self.width = 120
-            self.height = 120
-            self.speed = 1.0
-            self.color = (200, 0, 0)
-            self.max_health = 300
-            self.score_value = 500
-            self.shoot_delay = 30
-            self.pattern_timer = 0
-            
+        self.kind = kind
+        self.rng = rng
+        self.timers = timers
+        self.width = kind.width
+        self.height = kind.height
+        if kind.min_speed == kind.max_speed:
+            self.speed = kind.min_speed
+        else:
+            self.speed = rng.uniform(kind.min_speed, kind.max_speed)
+        self.pattern_timer = 0
+        self.x = rng.randint(0, SCREEN_WIDTH - self.width)
+        self.y = rng.randint(-100, -40)
+        self.prev_x = self.x
+        self.prev_y = self.y
+        self.next_shot = timers.after(rng.randint(30, 180), self, "next_shot")
+        self.health = kind.max_health
+        self.flash_until = 0
+        
+    def state(self):
+        return (ENEMY_TYPE_NAMES.index(self.type), self.x, self.y, self.prev_x, self.prev_y,
+                self.speed, self.next_shot, self.health, self.flash_until, self.pattern_timer)
+                
+    def set_state(self, values, rng, timers):
+        self.alive = True
+        self.type = ENEMY_TYPE_NAMES[values[0]]
+        self.kind = ENEMY_TYPES[self.type]
+        self.rng = rng
+        self.timers = timers
+        self.width = self.kind.width
+        self.height = self.kind.height
+        (self.x, self.y, self.prev_x, self.prev_y, self.speed,
+         self.next_shot, self.health, self.flash_until, self.pattern_timer) = values[1:]
+         
     def update(self):
-        self.y += self.speed
-        self.shoot_timer -= 1
+        step = self.timers.step
+        self.y += self.speed * step
         
         if self.type == "boss":
-            self.x += math.sin(self.pattern_timer * 0.05) * 2
+            self.x += math.sin(self.pattern_timer * step * 0.05) * 2 * step
             self.pattern_timer += 1
             
-        if self.hit_timer > 0:
-            self.hit_timer -= 1
+    def flashing(self):
+        return self.flash_until > self.timers.now
             
-    def draw(self, screen):
-        color = self.color
-        if self.hit_timer > 0:
+    def sprite_key(self):
+        return ("enemy", self.type, self.flashing())
+        
+    def render_sprite(self):
+        color = self.kind.color
+        if self.flashing():
             color = WHITE
             
+        sprite = new_sprite(self.width, self.height)
         if self.type == "boss":
             # Draw boss with more detail
-            pygame.draw.ellipse(screen, color, (self.x, self.y, self.width, self.height))
-            pygame.draw.circle(screen, YELLOW, (int(self.x + self.width//2), 
-                                              int(self.y + self.height//2)), 20)
-            pygame.draw.circle(screen, BLACK, (int(self.x + self.width//2), 
-                                             int(self.y + self.height//2)), 10)
-            # Health bar for boss
-            bar_width = self.width
-            bar_height = 8
-            health_ratio = self.health / self.max_health
-            pygame.draw.rect(screen, RED, (self.x, self.y - 15, bar_width, bar_height))
-            pygame.draw.rect(screen, GREEN, (self.x, self.y - 15, bar_width * health_ratio, bar_height))
+            pygame.draw.ellipse(sprite, color, (0, 0, self.width, self.height))
+            pygame.draw.circle(sprite, YELLOW, (self.width//2, self.height//2), 20)
+            pygame.draw.circle(sprite, BLACK, (self.width//2, self.height//2), 10)
         else:
-            pygame.draw.polygon(screen, color, [
-                (self.x + self.width//2, self.y),
-                (self.x, self.y + self.height),
-                (self.x + self.width, self.y + self.height)
+            pygame.draw.polygon(sprite, color, [
+                (self.width//2, 0),
+                (0, self.height),
+                (self.width, self.height)
             ])
             # Enemy cockpit
-            pygame.draw.circle(screen, BLACK, 
-                             (int(self.x + self.width//2), int(self.y + self.height//3)), 
-                             self.width//6)
+            pygame.draw.circle(sprite, BLACK, (self.width//2, self.height//3), self.width//6)
+        return sprite
+        
+    def health_bar(self):
+        bar_width = self.width
+        bar_height = 8
+        health_ratio = self.health / self.kind.max_health
+        return [(RED, (self.x, self.y - 15, bar_width, bar_height)),
+                (GREEN, (self.x, self.y - 15, bar_width * health_ratio, bar_height))]
             
     def shoot(self, enemy_bullets):
-        if self.shoot_timer <= 0:
-            if self.type == "boss":
-                # Boss shooting pattern
-                for angle in range(0, 360, 30):
-                    rad = math.radians(angle + self.pattern_timer * 5)
-                    enemy_bullets.append(
-                        EnemyBullet(self.x + self.width//2, self.y + self.height, 
-                                   math.sin(rad) * 3, math.cos(rad) * 3, "boss")
-                    )
-                self.shoot_timer = self.shoot_delay
-            else:
-                enemy_bullets.append(
-                    EnemyBullet(self.x + self.width//2, self.y + self.height, 
+        # Called when next_shot comes due
+        if self.type == "boss":
+            # Boss shooting pattern: a ring that turns between volleys
+            enemy_bullets.emit_ring(self.x + self.width//2, self.y + self.height,
+                                    BOSS_RING_BULLETS, 3, self.pattern_timer * self.timers.step * 5, "boss")
+            delay = self.kind.shoot_delay
+        else:
+            enemy_bullets.emit(self.x + self.width//2, self.y + self.height,
                                0, 5, self.type)
-                )
-                self.shoot_timer = self.shoot_delay + random.randint(-30, 30)
+            delay = self.kind.shoot_delay + self.rng.randint(-30, 30)
+        self.next_shot = self.timers.after(max(1, delay), self, "next_shot")
                 
     def take_damage(self, amount):
         self.health -= amount
-        self.hit_timer = 5
+        self.flash_until = self.timers.now + self.timers.ticks(5)
         return self.health <= 0
         
     def is_off_screen(self):
         return self.y > SCREEN_HEIGHT
 
-class EnemyBullet:
-    def __init__(self, x, y, dx, dy, bullet_type):
-        self.x = x
-        self.y = y
-        self.dx = dx
-        self.dy = dy
-        self.type = bullet_type
-        self.setup_bullet()
+class BulletField:
+    # Struct-of-arrays enemy bullets; live bullets occupy [0, count) in
+    # firing order. Volleys are emitted, moved, culled and tested against
+    # the player as whole-array operations
+    def __init__(self, capacity=MAX_ENEMY_BULLETS, step=1):
+        self.capacity = capacity
+        self.count = 0
+        self.high_water = 0
+        self.step = step  # game frames per tick, scales velocities as fired
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.prev_x = np.zeros(capacity)
+        self.prev_y = np.zeros(capacity)
+        self.dx = np.zeros(capacity)
+        self.dy = np.zeros(capacity)
+        self.width = np.zeros(capacity)
+        self.height = np.zeros(capacity)
+        self.damage = np.zeros(capacity, dtype=np.int32)
+        self.kind = np.zeros(capacity, dtype=np.intp)  # index into type_names
+        self.ids = np.zeros(capacity, dtype=np.uint32)  # increase in firing order, like pool serials
+        self.next_id = 0
+        # Bullets fly straight, so where and when each was fired (on the
+        # field's own update clock) places it at any later time
+        self.clock = 0
+        self.origin_x = np.zeros(capacity)
+        self.origin_y = np.zeros(capacity)
+        self.born = np.zeros(capacity, dtype=np.int64)
+        self.arrays = (self.x, self.y, self.prev_x, self.prev_y, self.dx, self.dy,
+                       self.width, self.height, self.damage, self.kind, self.ids,
+                       self.origin_x, self.origin_y, self.born)
+        self.type_names = list(ENEMY_BULLET_TYPES)
+        self.type_ids = {name: i for i, name in enumerate(self.type_names)}
+        self.sprite_tables = {}  # per drawing scale, rendered on first draw
+        
+    def __len__(self):
+        return self.count
+        
+    def clear(self):
+        self.count = 0
+        
+    def stats(self):
+        return {"live": self.count, "high_water": self.high_water, "capacity": self.capacity}
+        
+    def emit(self, x, y, dx, dy, bullet_type):
+        # Any of x, y, dx, dy may be arrays; extras beyond capacity are dropped.
+        # dx, dy are per game frame
+        if self.step != 1:
+            dx = np.multiply(dx, self.step)
+            dy = np.multiply(dy, self.step)
+        x, y, dx, dy = np.broadcast_arrays(x, y, dx, dy)
+        start = self.count
+        n = min(x.size, self.capacity - start)
+        if n <= 0:
+            return
+        end = start + n
+        kind = ENEMY_BULLET_TYPES[bullet_type]
+        self.x[start:end] = x.ravel()[:n]
+        self.y[start:end] = y.ravel()[:n]
+        self.prev_x[start:end] = self.x[start:end]
+        self.prev_y[start:end] = self.y[start:end]
+        self.dx[start:end] = dx.ravel()[:n]
+        self.dy[start:end] = dy.ravel()[:n]
+        self.width[start:end] = kind.width
+        self.height[start:end] = kind.height
+        self.damage[start:end] = kind.damage
+        self.kind[start:end] = self.type_ids[bullet_type]
+        self.ids[start:end] = np.arange(self.next_id, self.next_id + n)
+        self.next_id += n
+        self.origin_x[start:end] = self.x[start:end]
+        self.origin_y[start:end] = self.y[start:end]
+        self.born[start:end] = self.clock
+        self.count = end
+        self.high_water = max(self.high_water, end)
+        
+    def emit_ring(self, x, y, count, speed, phase, bullet_type):
+        # count bullets evenly spaced around a circle, the first at phase
+        # degrees; advancing phase between volleys makes a spiral
+        angles = np.radians(np.arange(count) * (360 / count) + phase)
+        self.emit(x, y, np.sin(angles) * speed, np.cos(angles) * speed, bullet_type)
+        
+    def compact(self, keep):
+        for arr in self.arrays:
+            arr[:len(keep)] = arr[keep]
+        self.count = len(keep)
         
-    def setup_bullet(self):
-        if self.type == "boss":
-            self.width = 8
-            self.height = 8
-            self.color = PURPLE
-            self.damage = 20
-        else:
-            self.width = 6
-            self.height = 12
-            self.color = RED
-            self.damage = 10
-            
     def update(self):
-        self.x += self.dx
-        self.y += self.dy
+        self.clock += 1
+        n = self.count
+        if n == 0:
+            return
+        x = self.x[:n]
+        y = self.y[:n]
+        x += self.dx[:n]
+        y += self.dy[:n]
         
-    def draw(self, screen):
-        pygame.draw.ellipse(screen, self.color, (self.x, self.y, self.width, self.height))
+        # Cull off-screen bullets with one stable compaction
+        on_screen = (y <= SCREEN_HEIGHT) & (y >= 0) & (x >= 0) & (x <= SCREEN_WIDTH)
+        keep = np.flatnonzero(on_screen)
+        if len(keep) < n:
+            self.compact(keep)
+            
+    def hits(self, x, y, width, height):
+        # Indices of bullets overlapping the rect, in firing order
+        n = self.count
+        bx = self.x[:n]
+        by = self.y[:n]
+        return np.flatnonzero((bx < x + width) & (bx + self.width[:n] > x) &
+                              (by < y + height) & (by + self.height[:n] > y))
+                              
+    def kill(self, indices):
+        if len(indices):
+            alive = np.ones(self.count, dtype=bool)
+            alive[indices] = False
+            self.compact(np.flatnonzero(alive))
+            
+    def remember(self):
+        n = self.count
+        self.prev_x[:n] = self.x[:n]
+        self.prev_y[:n] = self.y[:n]
         
-    def is_off_screen(self):
-        return (self.y > SCREEN_HEIGHT or self.y < 0 or 
-                self.x < 0 or self.x > SCREEN_WIDTH)
+    def blend(self, alpha):
+        # Same as Game.blend_positions for the whole field
+        n = self.count
+        saved = (self.x[:n].copy(), self.y[:n].copy())
+        self.x[:n] = self.prev_x[:n] + (saved[0] - self.prev_x[:n]) * alpha
+        self.y[:n] = self.prev_y[:n] + (saved[1] - self.prev_y[:n]) * alpha
+        return saved
+        
+    def restore(self, saved):
+        n = len(saved[0])
+        self.x[:n] = saved[0]
+        self.y[:n] = saved[1]
+        
+    def render_sprites(self, scale):
+        sprites = []
+        for kind in ENEMY_BULLET_TYPES.values():
+            width = max(1, round(kind.width * scale))
+            height = max(1, round(kind.height * scale))
+            sprite = new_sprite(width, height)
+            pygame.draw.ellipse(sprite, kind.color, (0, 0, width, height))
+            sprites.append(finish_sprite(sprite))
+        table = np.empty(len(sprites), dtype=object)
+        table[:] = sprites
+        return table
+        
+    def batch(self, scale=1.0):
+        # (sprite, position) pairs for blit_batch, in canvas pixels
+        n = self.count
+        if n == 0:
+            return []
+        table = self.sprite_tables.get(scale)
+        if table is None:
+            table = self.sprite_tables[scale] = self.render_sprites(scale)
+        px = (self.x[:n] * scale).astype(np.intp)
+        py = (self.y[:n] * scale).astype(np.intp)
+        return list(zip(table[self.kind[:n]].tolist(), zip(px.tolist(), py.tolist())))
 
 class PowerUp:
+    __slots__ = ("alive", "serial", "x", "y", "prev_x", "prev_y", "type", "color")
+    sprite_offset = (-15, -15)  # drawn centred on (x, y)
+    width = 30
+    height = 30
+    speed = 2
+    STATE = struct.Struct("<B4d")
+    
     def __init__(self, x, y, power_type):
+        self.reset(x, y, power_type)
+        
+    def reset(self, x, y, power_type):
+        self.alive = True
         self.x = x
         self.y = y
+        self.prev_x = x
+        self.prev_y = y
         self.type = power_type
-        self.width = 30
-        self.height = 30
-        self.speed = 2
-        self.setup_powerup()
+        self.color = POWERUP_TYPES[power_type].color
         
-    def setup_powerup(self):
-        if self.type == "health":
-            self.color = GREEN
-        elif self.type == "weapon":
-            self.color = YELLOW
-        elif self.type == "shield":
-            self.color = BLUE
-        elif self.type == "laser":
-            self.color = ORANGE
-            
-    def update(self):
-        self.y += self.speed
+    def state(self):
+        return (POWERUP_TYPE_NAMES.index(self.type), self.x, self.y, self.prev_x, self.prev_y)
+        
+    def set_state(self, values):
+        self.alive = True
+        self.type = POWERUP_TYPE_NAMES[values[0]]
+        self.color = POWERUP_TYPES[self.type].color
+        self.x, self.y, self.prev_x, self.prev_y = values[1:]
+        
+    def update(self, step=1):
+        self.y += self.speed * step
         
-    def draw(self, screen):
+    def sprite_key(self):
+        return ("powerup", self.type)
+        
+    def render_sprite(self):
+        sprite = new_sprite(31, 31)
+        x, y = 15, 15
         if self.type == "health":
-            pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), 15)
-            pygame.draw.polygon(screen, WHITE, [
-                (self.x, self.y - 8),
-                (self.x - 6, self.y + 4),
-                (self.x + 6, self.y + 4)
+            pygame.draw.circle(sprite, self.color, (x, y), 15)
+            pygame.draw.polygon(sprite, WHITE, [
+                (x, y - 8),
+                (x - 6, y + 4),
+                (x + 6, y + 4)
             ])
         elif self.type == "weapon":
-            pygame.draw.rect(screen, self.color, 
-                            (self.x - 10, self.y - 10, 20, 20))
-            pygame.draw.rect(screen, BLACK, 
-                            (self.x - 5, self.y - 15, 10, 20))
+            pygame.draw.rect(sprite, self.color, 
+                            (x - 10, y - 10, 20, 20))
+            pygame.draw.rect(sprite, BLACK, 
+                            (x - 5, y - 15, 10, 20))
         elif self.type == "shield":
-            pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), 15, 3)
-            pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), 10, 3)
+            pygame.draw.circle(sprite, self.color, (x, y), 15, 3)
+            pygame.draw.circle(sprite, self.color, (x, y), 10, 3)
         elif self.type == "laser":
-            pygame.draw.rect(screen, self.color, 
-                            (self.x - 12, self.y - 3, 24, 6))
-            pygame.draw.rect(screen, self.color, 
-                            (self.x - 3, self.y - 12, 6, 24))
+            pygame.draw.rect(sprite, self.color, 
+                            (x - 12, y - 3, 24, 6))
+            pygame.draw.rect(sprite, self.color, 
+                            (x - 3, y - 12, 6, 24))
+        return sprite
             
     def apply(self, player):
         if self.type == "health":
             player.health = min(player.max_health, player.health + 30)
         elif self.type == "weapon":
             player.power_level = min(3, player.power_level + 1)
-            player.power_time = 600  # 10 seconds
+            player.power_until = player.timers.after(600, player, "power_until")  # 10 seconds
         elif self.type == "shield":
-            player.invincible = 180  # 3 seconds
+            player.invincible_until = player.timers.now + player.timers.ticks(180)  # 3 seconds
         elif self.type == "laser":
             player.weapon_type = "laser"
             player.special_ammo = 50
@@ -359,288 +806,1526 @@ class PowerUp:
     def is_off_screen(self):
         return self.y > SCREEN_HEIGHT
 
-class Particle:
-    def __init__(self, x, y, color):
-        self.x = x
-        self.y = y
-        self.color = color
-        self.size = random.randint(2, 6)
-        self.speed_x = random.uniform(-3, 3)
-        self.speed_y = random.uniform(-3, 3)
-        self.lifetime = random.randint(20, 40)
+class ParticleSystem:
+    # Struct-of-arrays particle store; live particles occupy [0, count)
+    MAX_RADIUS = 6
+    
+    def __init__(self, capacity=MAX_PARTICLES, seed=None, step=1):
+        self.capacity = capacity
+        self.count = 0
+        self.step = step  # game frames per tick
+        self.density = 1.0  # share of each burst emitted (quality level)
+        self.life = 1.0  # lifetime scale (quality level)
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.speed_x = np.zeros(capacity)
+        self.speed_y = np.zeros(capacity)
+        self.size = np.zeros(capacity)
+        self.lifetime = np.zeros(capacity, dtype=np.int32)
+        self.color = np.zeros(capacity, dtype=np.intp)  # index into palette
+        self.arrays = (self.x, self.y, self.speed_x, self.speed_y,
+                       self.size, self.lifetime, self.color)
+        self.rng = np.random.default_rng(seed)
+        
+        # One pre-rendered circle per (color, radius), looked up by
+        # color * (MAX_RADIUS + 1) + radius
+        self.palette = {}
+        self.sprite_table = np.empty(0, dtype=object)
+        
+    def __len__(self):
+        return self.count
+        
+    def clear(self):
+        self.count = 0
+        
+    def color_id(self, color):
+        color = tuple(color)
+        index = self.palette.get(color)
+        if index is None:
+            index = len(self.palette)
+            self.palette[color] = index
+            sprites = [None]
+            for radius in range(1, self.MAX_RADIUS + 1):
+                sprite = new_sprite(radius * 2 + 1, radius * 2 + 1)
+                pygame.draw.circle(sprite, color, (radius, radius), radius)
+                sprites.append(finish_sprite(sprite))
+            table = np.empty(len(self.sprite_table) + len(sprites), dtype=object)
+            table[:len(self.sprite_table)] = self.sprite_table
+            table[len(self.sprite_table):] = sprites
+            self.sprite_table = table
+        return index
+        
+    def emit(self, x, y, color, n):
+        # Burst of n particles at (x, y); extras beyond capacity are dropped
+        start = self.count
+        n = min(int(n * self.density), self.capacity - start)
+        if n <= 0:
+            return
+        end = start + n
+        rng = self.rng
+        self.x[start:end] = x
+        self.y[start:end] = y
+        self.speed_x[start:end] = rng.uniform(-3, 3, n) * self.step
+        self.speed_y[start:end] = rng.uniform(-3, 3, n) * self.step
+        self.size[start:end] = rng.integers(2, 7, n)
+        self.lifetime[start:end] = rng.integers(20, 41, n) * self.life / self.step
+        self.color[start:end] = self.color_id(color)
+        self.count = end
         
     def update(self):
-        self.x += self.speed_x
-        self.y += self.speed_y
-        self.lifetime -= 1
-        self.size = max(0, self.size - 0.1)
+        n = self.count
+        if n == 0:
+            return
+        self.x[:n] += self.speed_x[:n]
+        self.y[:n] += self.speed_y[:n]
+        self.lifetime[:n] -= 1
+        size = self.size[:n]
+        size -= 0.1 * self.step
+        np.maximum(size, 0, out=size)
         
-    def draw(self, screen):
-        if self.lifetime > 0:
-            pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), int(self.size))
+        # Cull dead particles with one stable compaction
+        alive = self.lifetime[:n] > 0
+        keep = np.flatnonzero(alive)
+        if len(keep) < n:
+            for arr in self.arrays:
+                arr[:len(keep)] = arr[keep]
+            self.count = len(keep)
             
-    def is_dead(self):
-        return self.lifetime <= 0
+    def batch(self, scale=1.0):
+        # (sprite, position) pairs for blit_batch, in canvas pixels; scaled
+        # particles just use the smaller circles
+        n = self.count
+        if n == 0:
+            return []
+        radius = (self.size[:n] * scale).astype(np.intp)
+        visible = np.flatnonzero(radius > 0)
+        if len(visible) == 0:
+            return []
+        radius = radius[visible]
+        keys = self.color[visible] * (self.MAX_RADIUS + 1) + radius
+        px = (self.x[visible] * scale).astype(np.intp) - radius
+        py = (self.y[visible] * scale).astype(np.intp) - radius
+        return list(zip(self.sprite_table[keys].tolist(), zip(px.tolist(), py.tolist())))
 
-class Starfield:
+class SpriteCache:
+    # Entity images rendered once per sprite_key() and blitted from then on.
+    # New entity variants get an entry on first use; past max_entries the
+    # oldest entry is dropped. Images and positions come out scaled to the
+    # canvas (nearest-pixel, so the colorkey survives)
+    def __init__(self, scale=1.0, max_entries=SPRITE_CACHE_SIZE):
+        self.scale = scale
+        self.max_entries = max_entries
+        self.sprites = {}
+        self.hits = 0
+        self.misses = 0
+        
+    def get(self, entity):
+        key = entity.sprite_key()
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            self.misses += 1
+            if len(self.sprites) >= self.max_entries:
+                del self.sprites[next(iter(self.sprites))]
+            sprite = entity.render_sprite()
+            if self.scale != 1:
+                width, height = sprite.get_size()
+                sprite = pygame.transform.scale(sprite, (max(1, round(width * self.scale)),
+                                                         max(1, round(height * self.scale))))
+            sprite = finish_sprite(sprite)
+            self.sprites[key] = sprite
+        else:
+            self.hits += 1
+        return sprite
+        
+    def batch(self, entities):
+        # (sprite, position) pairs for everything with a cached image, and
+        # (color, rect) shapes for the rest
+        scale = self.scale
+        batch = []
+        shapes = []
+        for entity in entities:
+            if entity.sprite_key() is None:
+                shape = entity.shape()
+                if shape is not None:
+                    shapes.append(shape)
+                continue
+            x, y = entity.sprite_offset
+            batch.append((self.get(entity), ((entity.x + x) * scale, (entity.y + y) * scale)))
+        return batch, scale_shapes(shapes, scale)
+
+# Entity sprites are shared by every game in the process drawing at a scale
+SPRITE_CACHES = {}
+
+def sprite_cache(scale):
+    cache = SPRITE_CACHES.get(scale)
+    if cache is None:
+        cache = SPRITE_CACHES[scale] = SpriteCache(scale)
+    return cache
+
+# Controls help shown in the corner of the HUD
+CONTROLS = [
+    "CONTROLS:",
+    "Arrow Keys - Move",
+    "Space - Shoot (Hold)",
+    "Z - Single Shot"
+]
+
+class HUD:
+    # Text surfaces that are only re-rendered when their text changes, plus
+    # the controls help and game-over overlay, which never change
     def __init__(self):
-        self.stars = []
-        for _ in range(200):
-            self.stars.append([
-                random.randint(0, SCREEN_WIDTH),
-                random.randint(0, SCREEN_HEIGHT),
-                random.uniform(0.1, 0.5)
-            ])
+        self.labels = {}
+        self.hits = 0
+        self.misses = 0
+        self.controls = None
+        self.overlay = None
+        self.panel = None  # (rows, surface) of the last profiler panel
+        
+    def text(self, name, font, text, color):
+        label = self.labels.get(name)
+        if label is not None and label[0] == text and label[1] == color:
+            self.hits += 1
+            return label[2]
+        self.misses += 1
+        surface = font.render(text, True, color)
+        self.labels[name] = (text, color, surface)
+        return surface
+        
+    def controls_layer(self, font, scale=1.0):
+        if self.controls is None:
+            self.controls = [
+                (font.render(line, True, (150, 150, 150)),
+                 ((SCREEN_WIDTH - 200) * scale, (SCREEN_HEIGHT - 120 + i * 25) * scale))
+                for i, line in enumerate(CONTROLS)
+            ]
+        return self.controls
+        
+    def game_over_overlay(self, size):
+        # Semi-transparent overlay
+        if self.overlay is None or self.overlay.get_size() != size:
+            self.overlay = pygame.Surface(size, pygame.SRCALPHA)
+            self.overlay.fill((0, 0, 0, 200))
+        return self.overlay
+        
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "labels": len(self.labels)}
+
+class Starfield:
+    # Stars are baked into one screen-sized layer per speed band. A layer
+    # scrolls as a whole and wraps around, so drawing costs two blits per
+    # layer however many stars there are
+    def __init__(self, rng=random, count=STAR_COUNT, layers=STAR_LAYERS):
+        self.rng = rng
+        self.count = count
+        band = (STAR_MAX_SPEED - STAR_MIN_SPEED) / layers
+        self.bands = [(STAR_MIN_SPEED + band * i, STAR_MIN_SPEED + band * (i + 1))
+                      for i in range(layers)]
+        self.speeds = [(low + high) / 2 for low, high in self.bands]
+        self.offsets = [0.0] * layers
+        self.layers = None  # baked on first draw, at the size drawn into
+        
+    def bake(self, width, height):
+        rng = self.rng
+        sx = width / SCREEN_WIDTH
+        sy = height / SCREEN_HEIGHT
+        self.layers = []
+        for i, (low, high) in enumerate(self.bands):
+            layer = new_sprite(width, height)
+            for _ in range(self.count // len(self.bands) + (i < self.count % len(self.bands))):
+                brightness = int(rng.uniform(low, high) * 255)
+                pygame.draw.circle(layer, (brightness, brightness, brightness),
+                                   (int(rng.randint(0, SCREEN_WIDTH) * sx),
+                                    int(rng.randint(0, SCREEN_HEIGHT) * sy)), 1)
+            self.layers.append(finish_sprite(layer))
             
-    def update(self):
-        for star in self.stars:
-            star[1] += star[2]
-            if star[1] > SCREEN_HEIGHT:
-                star[1] = 0
-                star[0] = random.randint(0, SCREEN_WIDTH)
+    def update(self, step=1):
+        for i, speed in enumerate(self.speeds):
+            self.offsets[i] = (self.offsets[i] + speed * step) % SCREEN_HEIGHT
                 
-    def draw(self, screen):
-        for x, y, speed in self.stars:
-            brightness = int(speed * 255)
-            pygame.draw.circle(screen, (brightness, brightness, brightness), (int(x), int(y)), 1)
+    def draw(self, screen, offsets=None):
+        # offsets: scroll positions captured earlier, default the current
+        # ones; layers with None are skipped
+        width, height = screen.get_size()
+        if self.layers is None or self.layers[0].get_size() != (width, height):
+            self.bake(width, height)
+        scale = height / SCREEN_HEIGHT
+        for layer, offset in zip(self.layers, offsets or self.offsets):
+            if offset is None:
+                continue
+            y = int(offset * scale)
+            screen.blit(layer, (0, y))
+            if y:
+                screen.blit(layer, (0, y - height))
+
+def merge_rects(rects, bounds):
+    # Clip to bounds and union overlapping rects until none overlap
+    merged = []
+    for rect in rects:
+        rect = rect.clip(bounds)
+        if not rect.w or not rect.h:
+            continue
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+class DirtyRectRenderer:
+    # Restores the background only where the previous frame drew and sends
+    # just the changed regions to the display. The background (stars and the
+    # controls help) is baked once, so the starfield holds still in this mode
+    def __init__(self, threshold=DIRTY_RECT_THRESHOLD):
+        self.threshold = threshold
+        self.background = None
+        self.previous = []
+        self.rects = []
+        self.fraction = 1.0  # share of the screen updated last frame
+        
+    def begin(self, screen, draw_background):
+        if self.background is None:
+            self.background = pygame.Surface(screen.get_size())
+            if pygame.display.get_surface() is not None:
+                self.background = self.background.convert()
+            draw_background(self.background)
+            screen.blit(self.background, (0, 0))
+            self.previous = [screen.get_rect()]
+        else:
+            for rect in self.previous:
+                screen.blit(self.background, rect, rect)
+        self.rects = []
+        return self.rects
+        
+    def present(self, screen):
+        bounds = screen.get_rect()
+        dirty = merge_rects(self.previous + self.rects, bounds)
+        area = sum(rect.w * rect.h for rect in dirty)
+        total = bounds.w * bounds.h
+        if area > total * self.threshold:
+            pygame.display.flip()
+            self.fraction = 1.0
+        else:
+            pygame.display.update(dirty)
+            self.fraction = area / total
+        self.previous = self.rects
+
+def rects_overlap(a, b):
+    return (a.x < b.x + b.width and
+            a.x + a.width > b.x and
+            a.y < b.y + b.height and
+            a.y + a.height > b.y)
+
+class SpatialHash:
+    def __init__(self, cell_size=COLLISION_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.min_y = 0
+        self.max_y = 0
+        
+    def build(self, objects):
+        # Rebuilt every frame; buckets hold list indices in ascending order
+        self.cells.clear()
+        cs = self.cell_size
+        cells = self.cells
+        min_y = max_y = None
+        for i, obj in enumerate(objects):
+            if not obj.alive:
+                continue
+            x0 = int(obj.x // cs)
+            x1 = int((obj.x + obj.width) // cs)
+            y0 = int(obj.y // cs)
+            y1 = int((obj.y + obj.height) // cs)
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    bucket = cells.get((cx, cy))
+                    if bucket is None:
+                        cells[(cx, cy)] = [i]
+                    else:
+                        bucket.append(i)
+            if min_y is None or obj.y < min_y:
+                min_y = obj.y
+            if max_y is None or obj.y + obj.height > max_y:
+                max_y = obj.y + obj.height
+        self.min_y = min_y or 0
+        self.max_y = max_y or 0
+        
+    def query(self, x, y, width, height):
+        # Candidate indices whose cells touch the rect, in list order
+        cs = self.cell_size
+        cells = self.cells
+        x0 = int(x // cs)
+        x1 = int((x + width) // cs)
+        y0 = int(y // cs)
+        y1 = int((y + height) // cs)
+        if x0 == x1 and y0 == y1:
+            return cells.get((x0, y0), ())
+        found = set()
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    found.update(bucket)
+        return sorted(found)
+        
+    def query_column(self, x, width):
+        # Everything overlapping a full-height vertical strip
+        return self.query(x, self.min_y, width, self.max_y - self.min_y)
+
+class TimerWheel:
+    # Frame-indexed deadlines. Whatever owns a timer keeps its due frame in
+    # one of its own fields and schedules (frame, owner, field) here; each
+    # frame advance() looks at a single slot and hands back only what is due.
+    # Moving or dropping a timer is just changing the field: entries that no
+    # longer match it are stale and skipped when their slot comes round.
+    # Durations are given in game frames (1/SIM_RATE s); step is how many of
+    # those one tick covers, so other sim rates keep the same game speed
+    def __init__(self, slots=TIMER_WHEEL_SLOTS, step=1):
+        self.slots = [[] for _ in range(slots)]
+        self.now = 0
+        self.fired = 0
+        self.stale = 0
+        self.step = step
+        
+    def ticks(self, frames):
+        # Game frames to ticks, at least one
+        if self.step == 1:
+            return frames
+        return max(1, round(frames / self.step))
+        
+    def frames(self, ticks):
+        # Ticks to whole game frames, rounded up
+        if self.step == 1:
+            return ticks
+        return math.ceil(ticks * self.step)
+        
+    def schedule(self, frame, owner, event):
+        self.slots[frame % len(self.slots)].append((frame, owner, event))
+        return frame
+        
+    def after(self, frames, owner, event):
+        return self.schedule(self.now + self.ticks(frames), owner, event)
+        
+    def resume(self, owner, event):
+        # Back on the wheel after a restore, unless already past
+        frame = getattr(owner, event)
+        if frame > self.now:
+            self.schedule(frame, owner, event)
+            
+    def clear(self, now=0):
+        for slot in self.slots:
+            slot.clear()
+        self.now = now
+        
+    def advance(self, frame):
+        # Moves the clock to frame; returns {event: [owner, ...]} for what is
+        # due, each owner once and in the order scheduled
+        self.now = frame
+        slot = self.slots[frame % len(self.slots)]
+        if not slot:
+            return {}
+        due = {}
+        later = []
+        for entry in slot:
+            when, owner, event = entry
+            if when > frame:
+                later.append(entry)  # a lap or more out
+            elif when < frame or getattr(owner, event) != frame:
+                self.stale += 1
+            else:
+                owners = due.setdefault(event, [])
+                if owner not in owners:
+                    owners.append(owner)
+                    self.fired += 1
+        slot[:] = later
+        return due
+        
+    def pending(self):
+        # Live timers as (frame, owner, event), soonest first
+        entries = [entry for slot in self.slots for entry in slot
+                   if entry[0] > self.now and getattr(entry[1], entry[2]) == entry[0]]
+        return sorted(entries, key=lambda entry: entry[0])
+        
+    def stats(self):
+        return {
+            "scheduled": sum(len(slot) for slot in self.slots),
+            "fired": self.fired,
+            "stale": self.stale,
+        }
+
+class EntityPool:
+    # Entities in spawn order. Dead ones are only marked during the frame and
+    # dropped by one compact() pass at its end; their objects are kept per
+    # class and handed back out by spawn() through reset(). Every spawn gets
+    # the next serial number, so serials increase in pool order
+    def __init__(self, name):
+        self.name = name
+        self.serial = 0
+        self.items = []
+        self.free = {}
+        self.live = 0
+        self.high_water = 0
+        self.allocations = 0
+        self.allocations_avoided = 0
+        
+    def __iter__(self):
+        return iter(self.items)
+        
+    def __len__(self):
+        return self.live
+        
+    def spawn(self, cls, *args):
+        free = self.free.get(cls)
+        if free:
+            obj = free.pop()
+            obj.reset(*args)
+            self.allocations_avoided += 1
+        else:
+            obj = cls(*args)
+            self.allocations += 1
+        obj.serial = self.serial
+        self.serial += 1
+        self.items.append(obj)
+        self.live += 1
+        if self.live > self.high_water:
+            self.high_water = self.live
+        return obj
+        
+    def kill(self, obj):
+        if obj.alive:
+            obj.alive = False
+            self.live -= 1
+            
+    def compact(self):
+        items = self.items
+        if self.live == len(items):
+            return
+        keep = []
+        for obj in items:
+            if obj.alive:
+                keep.append(obj)
+            else:
+                self.free.setdefault(type(obj), []).append(obj)
+        items[:] = keep
+        
+    def clear(self):
+        for obj in self.items:
+            self.kill(obj)
+        self.compact()
+        
+    def take(self, cls):
+        # A free object, or a new one without running reset(), for the
+        # caller to fill in before adopt()
+        free = self.free.get(cls)
+        if free:
+            self.allocations_avoided += 1
+            return free.pop()
+        self.allocations += 1
+        return cls.__new__(cls)
+        
+    def adopt(self, obj):
+        obj.serial = self.serial
+        self.serial += 1
+        self.items.append(obj)
+        self.live += 1
+        if self.live > self.high_water:
+            self.high_water = self.live
+        
+    def stats(self):
+        return {
+            "live": self.live,
+            "high_water": self.high_water,
+            "allocations": self.allocations,
+            "allocations_avoided": self.allocations_avoided,
+        }
+
+def keyboard_input(game):
+    keys = pygame.key.get_pressed()
+    actions = 0
+    if keys[pygame.K_LEFT]:
+        actions |= ACTION_LEFT
+    if keys[pygame.K_RIGHT]:
+        actions |= ACTION_RIGHT
+    if keys[pygame.K_UP]:
+        actions |= ACTION_UP
+    if keys[pygame.K_DOWN]:
+        actions |= ACTION_DOWN
+    if keys[pygame.K_SPACE]:
+        actions |= ACTION_FIRE
+    return actions
+
+def idle_input(game):
+    return 0
+
+def autopilot_input(game):
+    # Hold fire and line up under the lowest enemy
+    player = game.player
+    target = None
+    for enemy in game.enemies:
+        if enemy.alive and (target is None or enemy.y > target.y):
+            target = enemy
+    actions = ACTION_FIRE
+    if target is not None:
+        center = player.x + player.width // 2
+        goal = target.x + target.width // 2
+        if goal < center - player.speed:
+            actions |= ACTION_LEFT
+        elif goal > center + player.speed:
+            actions |= ACTION_RIGHT
+    return actions
+
+def random_input(game):
+    # Mashes a new random combination every 10 frames; seeded from the game
+    # but separate from game.rng so the game itself plays out unchanged
+    rng = random.Random(game.seed * 1000003 + game.frame // 10)
+    return rng.randrange(64) & ~ACTION_SHOT | ACTION_FIRE * (rng.random() < 0.8)
+
+INPUT_SOURCES = {
+    "idle": idle_input,
+    "autopilot": autopilot_input,
+    "random": random_input,
+}
+
+# Replay file: header, then one zlib-compressed input byte per frame
+REPLAY_MAGIC = b"GDRP"
+REPLAY_VERSION = 1
+REPLAY_HEADER = struct.Struct("<4sHQIIQ")  # magic, version, seed, frames, wave, score
+
+# Game snapshot (see Game.snapshot): header, counts, player, entity records,
+# game stats, RNG states, star scroll, then the bullet and particle arrays
+SNAPSHOT_MAGIC = b"GDSS"
+SNAPSHOT_VERSION = 3
+SNAPSHOT_HEADER = struct.Struct("<4sHQIIIIi??b")  # ..., wave counters, next spawn, boss wave, game over, last hit
+# Counts: players, bullets, enemies, powerups, enemy bullets, particles, colors,
+# star layers, enemy bullet ids issued; then the enemy bullet clock
+SNAPSHOT_COUNTS = struct.Struct("<9IQ")
+SNAPSHOT_STATS = struct.Struct(f"<{len(ENEMY_TYPES) * 2 + 1 + len(POWERUP_TYPES)}I")
+SNAPSHOT_KIND = struct.Struct("<B")
+RANDOM_STATE = struct.Struct("<625I?d")  # random.Random: Mersenne Twister words, gauss_next
+NUMPY_RNG_STATE = struct.Struct("<QQQQ?I")  # PCG64: state and increment halves, buffered uint32
+BULLET_KINDS = (Bullet, LaserBeam)
+
+def snapshot_dtype(arr):
+    return np.dtype(np.int64) if arr.dtype == np.intp else arr.dtype
+
+class Replay:
+    def __init__(self, seed, actions=b"", wave=0, score=0):
+        self.seed = seed
+        self.actions = actions
+        self.wave = wave
+        self.score = score
+        
+    @property
+    def frames(self):
+        return len(self.actions)
+        
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.seed,
+                                       self.frames, self.wave, self.score))
+            f.write(zlib.compress(bytes(self.actions), 9))
+            
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, seed, frames, wave, score = REPLAY_HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError(f"{path} is not a version {REPLAY_VERSION} replay")
+        actions = zlib.decompress(data[REPLAY_HEADER.size:])
+        if len(actions) != frames:
+            raise ValueError(f"{path} is truncated")
+        return cls(seed, actions, wave, score)
+        
+    def input_source(self, game):
+        # Frame numbers start at 1; nothing is pressed past the recording
+        if game.frame <= len(self.actions):
+            return self.actions[game.frame - 1]
+        return 0
+        
+    def matches(self, game):
+        return (game.frame == self.frames and
+                game.wave == self.wave and
+                game.player.score == self.score)
+
+class ProfileWriter:
+    # Streams one row per profiled frame as CSV or, for any other extension,
+    # as JSON lines
+    def __init__(self, path):
+        self.file = open(path, "w", newline="")
+        self.csv = None
+        if path.endswith(".csv"):
+            fields = (["frame", "total_ms"] +
+                      ["update." + phase for phase in FrameProfiler.UPDATE_PHASES] +
+                      ["draw." + phase for phase in FrameProfiler.DRAW_PHASES] +
+                      ["count." + name for name in FrameProfiler.COUNTS] + ["quality"])
+            self.csv = csv.DictWriter(self.file, fields, restval=0)
+            self.csv.writeheader()
+            
+    def write(self, row):
+        if self.csv is not None:
+            self.csv.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + "\n")
+            
+    def close(self):
+        self.file.close()
+
+class FrameProfiler:
+    # Times each phase of update() and draw() and counts entities per frame.
+    # Game only calls in while enabled, so a disabled profiler costs one
+    # attribute test per update and draw
+    UPDATE_PHASES = ("player", "bullets", "enemy_bullets", "enemies", "powerups",
+                     "particles", "starfield", "spawn", "collisions")
+    DRAW_PHASES = ("capture", "background", "bullets", "enemy_bullets", "enemies", "powerups",
+                   "particles", "player", "hud", "video", "present")
+    COUNTS = ("bullets", "enemy_bullets", "enemies", "powerups", "particles")
+    
+    def __init__(self, path=None, window=PROFILE_WINDOW):
+        self.writer = ProfileWriter(path) if path else None
+        self.enabled = self.writer is not None
+        self.overlay = False
+        self.frame_times = deque(maxlen=window)
+        self.sample = {}
+        self.last_sample = {}  # phase times of the latest finished frame
+        self.counts = {}  # live object counts at the latest finished frame
+        self.rows = []  # overlay rows, empty until first asked for
+        self.frames = 0
+        self.last = 0.0
+        
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        self.enabled = self.overlay or self.writer is not None
+        
+    def start(self):
+        self.last = time.perf_counter()
+        
+    def mark(self, phase):
+        # Charge the time since the previous mark to phase
+        now = time.perf_counter()
+        self.sample[phase] = self.sample.get(phase, 0.0) + (now - self.last) * 1000.0
+        self.last = now
+        
+    def end_frame(self, game):
+        sample = self.sample
+        total = sum(sample.values())
+        self.frames += 1
+        self.frame_times.append(total)
+        self.last_sample = sample
+        self.counts = {
+            "bullets": len(game.bullets),
+            "enemy_bullets": len(game.enemy_bullets),
+            "enemies": len(game.enemies),
+            "powerups": len(game.powerups),
+            "particles": len(game.particles),
+        }
+        if self.writer is not None:
+            row = {"frame": self.frames, "total_ms": round(total, 4)}
+            for phase, ms in sample.items():
+                row[phase] = round(ms, 4)
+            for name, count in self.counts.items():
+                row["count." + name] = count
+            row["quality"] = game.governor.quality.name
+            self.writer.write(row)
+        self.sample = {}
+        
+    def percentiles(self):
+        times = sorted(self.frame_times)
+        if not times:
+            return 0.0, 0.0, 0.0
+        last = len(times) - 1
+        return tuple(times[min(last, int(p * len(times)))] for p in (0.50, 0.95, 0.99))
+        
+    def summary(self):
+        p50, p95, p99 = self.percentiles()
+        return f"{self.frames} frames: p50 {p50:.2f} ms, p95 {p95:.2f} ms, p99 {p99:.2f} ms"
+        
+    def overlay_rows(self):
+        # (label, value) rows, refreshed a few times a second so the HUD's
+        # text cache is not defeated by numbers that change every frame
+        if self.frames % 15 == 1 or not self.rows:
+            p50, p95, p99 = self.percentiles()
+            rows = [("frame ms", f"p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f}")]
+            if self.frames:
+                phases = sorted(self.last_sample.items(), key=lambda item: -item[1])
+                rows += [(phase, f"{ms:.2f}") for phase, ms in phases[:8]]
+                rows += [(name, str(count)) for name, count in self.counts.items()]
+            self.rows = rows
+        return self.rows
+        
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+class QualityGovernor:
+    # Watches the work time of each displayed frame (updates plus draw) and
+    # steps through QUALITY_LEVELS to stay inside the frame budget. To keep
+    # levels from flapping, a level is dropped as soon as the window average
+    # is over the high mark but only raised after a long calm stretch, and
+    # every change starts a fresh window
+    def __init__(self, budget_ms, level=0, adaptive=True):
+        self.budget = budget_ms
+        self.level = level
+        self.adaptive = adaptive
+        self.times = deque(maxlen=GOVERNOR_WINDOW)
+        self.calm = 0  # frames in a row under the low mark
+        self.changes = 0
+        self.history = deque(maxlen=GOVERNOR_HISTORY)  # (frame, old, new, average ms)
+        
+    @property
+    def quality(self):
+        return QUALITY_LEVELS[self.level]
+        
+    def observe(self, ms, frame):
+        # Returns True when the level changed
+        if not self.adaptive:
+            return False
+        times = self.times
+        times.append(ms)
+        self.calm = self.calm + 1 if ms < self.budget * GOVERNOR_LOW else 0
+        if len(times) < times.maxlen:
+            return False
+        average = sum(times) / len(times)
+        if average > self.budget * GOVERNOR_HIGH and self.level < len(QUALITY_LEVELS) - 1:
+            self.change(self.level + 1, frame, average)
+            return True
+        if self.calm >= GOVERNOR_RAISE_FRAMES and self.level > 0:
+            self.change(self.level - 1, frame, average)
+            return True
+        return False
+        
+    def change(self, level, frame, average):
+        self.history.append((frame, self.level, level, average))
+        self.changes += 1
+        self.level = level
+        self.times.clear()
+        self.calm = 0
+        
+    def describe(self, change):
+        frame, old, new, average = change
+        return f"frame {frame}: {QUALITY_NAMES[old]} -> {QUALITY_NAMES[new]} ({average:.1f} ms)"
+        
+    def overlay_rows(self):
+        mode = "auto" if self.adaptive else "fixed"
+        rows = [("quality", f"{self.quality.name} ({mode}, {self.budget:.1f} ms budget)")]
+        rows += [("", self.describe(change)) for change in list(self.history)[-3:]]
+        return rows
+        
+    def summary(self):
+        lines = [f"Quality {self.quality.name} after {self.changes} changes"]
+        lines += ["  " + self.describe(change) for change in self.history]
+        return "\n".join(lines)
+
+class InputRecorder:
+    # Collects the input bitmask of every simulated frame for a Replay
+    def __init__(self, path, seed):
+        self.path = path
+        self.seed = seed
+        self.actions = bytearray()
+        self.saved = False
+        
+    def record(self, actions):
+        self.actions.append(actions)
+        
+    def save(self, game):
+        Replay(self.seed, self.actions, game.wave, game.player.score).save(self.path)
+        self.saved = True
+
+# What Game.render_frame draws, captured by Game.capture_frame. Batches are
+# (sprite, position) lists and shapes (color, rect) lists, built fresh for
+# each frame and never changed afterwards
+Frame = namedtuple("Frame", "stars bullets lasers enemy_bullets enemies health_bars "
+                            "powerups particles player player_bars hud profile")
+HudState = namedtuple("HudState", "score wave lives weapon_type power_level special_ammo "
+                                  "power_time game_over")
+
+class RenderPipeline:
+    # Hands captured frames to a render thread. One frame can be waiting
+    # while another draws: double buffering. Display calls stay on the main
+    # thread, so a drawn frame waits for the next submit (or stop) to
+    # present it. Stalls are counted on both sides of the hand-off
+    def __init__(self, render, present=None):
+        self.render = render
+        self.present = present
+        self.changed = threading.Condition()
+        self.pending = None  # submitted, not yet taken by the render thread
+        self.busy = False  # the render thread has a frame not yet presented
+        self.drawn = False  # that frame is drawn and waiting for present
+        self.submitting = False  # the main thread is inside submit()
+        self.stopping = False
+        self.thread = None
+        self.error = None
+        self.rendered = 0
+        self.sim_stalls = 0  # a frame was ready but the renderer was still busy
+        self.render_stalls = 0  # the renderer was idle waiting for a frame
+        
+    def show(self):
+        # Main thread, holding changed
+        self.present()
+        self.drawn = False
+        self.busy = False
+        self.changed.notify_all()
+        
+    def submit(self, frame):
+        if self.thread is None:
+            self.stopping = False
+            self.thread = threading.Thread(target=self.loop, name="render", daemon=True)
+            self.thread.start()
+        with self.changed:
+            if self.pending is not None:
+                self.sim_stalls += 1
+            self.submitting = True
+            try:
+                while True:
+                    if self.error is not None:
+                        raise self.error
+                    if self.drawn:
+                        self.show()
+                    if self.pending is None:
+                        self.pending = frame
+                        self.changed.notify_all()
+                        return
+                    self.changed.wait()
+            finally:
+                self.submitting = False
+                
+    def loop(self):
+        while True:
+            with self.changed:
+                while self.pending is None and not self.stopping:
+                    self.changed.wait()
+                if self.pending is None:
+                    return
+                frame = self.pending
+                self.pending = None
+                self.busy = True
+                self.changed.notify_all()
+            try:
+                self.render(frame)
+            except Exception as error:
+                with self.changed:
+                    self.error = error
+                    self.changed.notify_all()
+                return
+            with self.changed:
+                self.rendered += 1
+                if self.pending is None and not self.submitting and not self.stopping:
+                    # Done with no frame on the way: counted here, since a
+                    # windowed renderer then idles waiting to be presented
+                    self.render_stalls += 1
+                if self.present is None:
+                    self.busy = False
+                else:
+                    self.drawn = True
+                self.changed.notify_all()
+                while self.busy:
+                    self.changed.wait()
+                    
+    def stop(self):
+        # Waits for the frames already submitted to be drawn and presented
+        if self.thread is not None:
+            with self.changed:
+                while self.error is None:
+                    if self.drawn:
+                        self.show()
+                    if self.pending is None and not self.busy:
+                        break
+                    self.changed.wait()
+                self.stopping = True
+                self.changed.notify_all()
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
+            
+    def summary(self):
+        return (f"Pipeline: {self.rendered} frames rendered, simulation waited on the renderer "
+                f"{self.sim_stalls}x, renderer waited on the simulation {self.render_stalls}x")
 
 class Game:
-    def __init__(self):
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-        pygame.display.set_caption("Galactic Defender")
-        self.clock = pygame.time.Clock()
+    def __init__(self, headless=False, seed=None, input_source=None,
+                 sim_rate=SIM_RATE, draw_fps=FPS, interpolate=True, star_count=STAR_COUNT,
+                 render_mode="full", record_path=None, profiler=None, pipelined=False,
+                 quality="auto", render_scale=1.0, window_size=None, smooth=False, players=1,
+                 capture=None):
+        # Headless games never open a window; draw() still works on an
+        # offscreen surface and step() runs the simulation unthrottled
+        self.headless = headless
+        
+        # Everything draws into self.screen, a canvas render_scale times the
+        # logical SCREEN_WIDTH x SCREEN_HEIGHT the simulation works in. When
+        # the window is the canvas size the canvas is the display itself;
+        # otherwise each frame is scaled once into the window
+        if not 0 < render_scale <= 1:
+            raise ValueError("render_scale must be in (0, 1]")
+        self.render_scale = render_scale
+        self.smooth = smooth
+        canvas_size = (max(1, round(SCREEN_WIDTH * render_scale)),
+                       max(1, round(SCREEN_HEIGHT * render_scale)))
+        self.window = None
+        self.view = None  # (window size, letterboxed area the canvas is scaled into)
+        if headless:
+            self.screen = pygame.Surface(canvas_size)
+            self.clock = None
+        else:
+            pygame.display.init()
+            window_size = tuple(window_size or (SCREEN_WIDTH, SCREEN_HEIGHT))
+            if window_size == canvas_size:
+                self.window = self.screen = pygame.display.set_mode(window_size)
+            else:
+                self.window = pygame.display.set_mode(window_size, pygame.RESIZABLE)
+                self.screen = pygame.Surface(canvas_size).convert()
+            pygame.display.set_caption("Galactic Defender")
+            self.clock = pygame.time.Clock()
+        if input_source is None:
+            input_source = idle_input if headless else keyboard_input
+        self.input_source = input_source
+        self.pending_actions = 0
+        # Co-op: input_source drives the first player, whoever drives the
+        # others (the co-op server) sets their actions here before update()
+        self.partner_actions = [0] * (players - 1)
+        
+        # Fixed-timestep loop settings (see run)
+        self.sim_rate = sim_rate
+        self.draw_fps = draw_fps
+        self.interpolate = interpolate and not headless
+        
+        # "full" redraws and flips every frame; "dirty" presents changed rects,
+        # so it needs the canvas to be the display
+        self.render_mode = render_mode
+        self.dirty = None
+        if render_mode == "dirty" and not headless and self.screen is self.window:
+            self.dirty = DirtyRectRenderer()
+        
+        # A FrameCapture gets every presented frame (F9 saves a clip)
+        self.capture = capture
+        if capture is not None:
+            capture.open(self.screen)
+        
+        # Pipelined games draw on a render thread while the next frame simulates
+        self.pipelined = pipelined
+        self.pipeline = None
+        if pipelined:
+            self.pipeline = RenderPipeline(self.render_frame, None if headless else self.present_frame)
+        
+        # All gameplay randomness goes through self.rng
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.frame = 0
+        # Gameplay speeds and durations are per game frame (1/SIM_RATE s);
+        # other sim rates take finer or coarser steps through the same game
+        step = 1 if sim_rate == SIM_RATE else SIM_RATE / sim_rate
+        self.timers = TimerWheel(step=step)  # countdowns as deadline ticks
+        self.frame_limit = None  # run() stops after this many frames
+        self.recorder = InputRecorder(record_path, self.seed) if record_path else None
+        self.profiler = profiler or FrameProfiler()
+        
         self.running = True
         self.game_over = False
+        self.last_hit_by = None  # enemy type behind the latest damage to the player
+        self.stats = {"kills": Counter(), "deaths": Counter(), "powerups": Counter()}
         self.wave = 1
         self.enemies_to_spawn = 5
         self.enemies_spawned = 0
-        self.wave_timer = 0
+        self.next_spawn = self.timers.schedule(1, self, "next_spawn")
         self.boss_wave = False
         
-        # Game objects
-        self.player = Player()
-        self.bullets = []
-        self.enemies = []
-        self.enemy_bullets = []
-        self.powerups = []
-        self.particles = []
-        self.starfield = Starfield()
+        # Game objects; self.player is the first player, who also holds the
+        # shared score
+        if not 1 <= players <= len(PLAYER_COLORS):
+            raise ValueError(f"players must be 1 to {len(PLAYER_COLORS)}")
+        self.players = [Player(self.timers, seat) for seat in range(players)]
+        self.player = self.players[0]
+        self.bullets = EntityPool("bullets")
+        self.enemies = EntityPool("enemies")
+        self.enemy_bullets = BulletField(step=step)
+        self.powerups = EntityPool("powerups")
+        self.pools = (self.bullets, self.enemies, self.powerups)
+        self.particles = ParticleSystem(seed=self.seed, step=step)
+        self.star_count = star_count
+        self.starfield = Starfield(random.Random(self.seed), star_count)
+        self.sprites = sprite_cache(render_scale)
+        
+        # Cosmetic quality: "auto" lets run() adapt it to the frame budget, a
+        # level name pins it. The simulation itself never depends on it
+        budget = 1000.0 / (draw_fps or FPS)
+        if quality == "auto":
+            self.governor = QualityGovernor(budget)
+        else:
+            self.governor = QualityGovernor(budget, QUALITY_NAMES.index(quality), adaptive=False)
+        self.apply_quality()
+        self.held_hud = None  # HUD state shown until hud_due (quality)
+        self.hud_due = 0
+        
+        # Collision broad phase
+        self.collision_mode = COLLISION_MODE
+        self.enemy_grid = SpatialHash()
+        self.powerup_grid = SpatialHash()
+        
+        self.hud = HUD()
+        self.held_pool_rows = None  # F3 overlay rows from pool_rows()
+        
+        # Restarting restores this instead of building a new game
+        self.initial_state = self.snapshot()
         
-        # Fonts
-        self.font_large = pygame.font.Font(None, 48)
-        self.font_medium = pygame.font.Font(None, 36)
-        self.font_small = pygame.font.Font(None, 24)
+    # Fonts are shared between games and only loaded once text is drawn
+    @property
+    def font_large(self):
+        return load_font(round(48 * self.render_scale))
+        
+    @property
+    def font_medium(self):
+        return load_font(round(36 * self.render_scale))
+        
+    @property
+    def font_small(self):
+        return load_font(round(24 * self.render_scale))
+        
+    def at(self, x, y):
+        # Logical position to canvas pixels
+        return (x * self.render_scale, y * self.render_scale)
         
     def handle_events(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self.running = False
+            elif event.type == pygame.VIDEORESIZE:
+                self.window = pygame.display.get_surface()
+                self.view = None
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     self.running = False
                 elif event.key == pygame.K_SPACE and self.game_over:
-                    self.__init__()  # Restart game
-                elif event.key == pygame.K_z:  # Rapid fire hold
-                    self.player.shoot(self.bullets)
+                    self.restart()
+                elif event.key == pygame.K_z and self.input_source is keyboard_input:  # Rapid fire hold
+                    self.pending_actions |= ACTION_SHOT
+                elif event.key == pygame.K_F2:  # Compare collision broad phases
+                    i = COLLISION_MODES.index(self.collision_mode)
+                    self.collision_mode = COLLISION_MODES[(i + 1) % len(COLLISION_MODES)]
+                elif event.key == pygame.K_F3:  # Frame profiler overlay
+                    self.profiler.toggle_overlay()
+                elif event.key == pygame.K_F9 and self.capture is not None:  # Save the last 30 seconds
+                    self.capture.save_clip()
                     
+    def restart(self, seed=None):
+        # Back to the state right after __init__ on a new seed, keeping the
+        # window, fonts and caches (only the first game is recorded)
+        self.restore(self.initial_state)
+        self.reseed(random.randrange(2**32) if seed is None else seed)
+        self.recorder = None
+        
+    def reseed(self, seed):
+        # Start the randomness over from seed, as Game(seed=seed) would
+        self.seed = seed
+        self.rng.seed(seed)
+        self.particles.rng = np.random.default_rng(seed)
+        self.starfield = Starfield(random.Random(seed), self.star_count)
+        
+    def snapshot(self):
+        # The simulation state as a versioned binary blob for restore(): wave
+        # counters, players, every entity, enemy bullets, particles, star
+        # scroll and both RNG states. Taken between frames; input, rendering
+        # and profiling settings are not part of it
+        field = self.enemy_bullets
+        particles = self.particles
+        offsets = self.starfield.offsets
+        
+        # Particle colors go out as indices into just the colors in use, in
+        # order of first use, so equal states give equal bytes whatever order
+        # this game's palette grew in
+        colors = particles.color[:particles.count]
+        used, first = np.unique(colors, return_index=True)
+        used = used[np.argsort(first)]
+        lookup = np.zeros(len(particles.palette), dtype=np.intp)
+        lookup[used] = np.arange(len(used))
+        every_color = list(particles.palette)
+        palette = [every_color[index] for index in used]
+        bullets = [bullet for bullet in self.bullets if bullet.alive]
+        enemies = [enemy for enemy in self.enemies if enemy.alive]
+        powerups = [powerup for powerup in self.powerups if powerup.alive]
+        last_hit = -1 if self.last_hit_by is None else ENEMY_TYPE_NAMES.index(self.last_hit_by)
+        parts = [
+            SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.seed, self.frame, self.wave,
+                                 self.enemies_to_spawn, self.enemies_spawned, self.next_spawn,
+                                 self.boss_wave, self.game_over, last_hit),
+            SNAPSHOT_COUNTS.pack(len(self.players), len(bullets), len(enemies), len(powerups),
+                                 field.count, particles.count, len(palette), len(offsets), field.next_id,
+                                 field.clock),
+        ]
+        parts.extend(Player.STATE.pack(*player.state()) for player in self.players)
+        for bullet in bullets:
+            cls = type(bullet)
+            parts.append(SNAPSHOT_KIND.pack(BULLET_KINDS.index(cls)))
+            parts.append(cls.STATE.pack(*bullet.state()))
+        parts.extend(Enemy.STATE.pack(*enemy.state()) for enemy in enemies)
+        parts.extend(PowerUp.STATE.pack(*powerup.state()) for powerup in powerups)
+        
+        stats = self.stats
+        parts.append(SNAPSHOT_STATS.pack(*[stats["kills"][name] for name in ENEMY_TYPE_NAMES],
+                                         *[stats["deaths"][name] for name in ENEMY_TYPE_NAMES + [None]],
+                                         *[stats["powerups"][name] for name in POWERUP_TYPE_NAMES]))
+        version, words, gauss = self.rng.getstate()
+        parts.append(RANDOM_STATE.pack(*words, gauss is not None, gauss or 0.0))
+        state = particles.rng.bit_generator.state
+        parts.append(NUMPY_RNG_STATE.pack(state["state"]["state"] >> 64, state["state"]["state"] & (2**64 - 1),
+                                          state["state"]["inc"] >> 64, state["state"]["inc"] & (2**64 - 1),
+                                          state["has_uint32"], state["uinteger"]))
+        parts.append(struct.pack(f"<{len(offsets)}d", *offsets))
+        
+        for arrays, n in ((field.arrays, field.count),
+                          (particles.arrays[:-1] + (lookup[colors],), particles.count)):
+            for arr in arrays:
+                parts.append(arr[:n].astype(snapshot_dtype(arr), copy=False).tobytes())
+        parts.append(bytes(channel for color in palette for channel in color))
+        return b"".join(parts)
+        
+    def restore(self, data):
+        # Puts back a snapshot() from this or any other Game
+        (magic, version, seed, self.frame, self.wave, self.enemies_to_spawn, self.enemies_spawned,
+         self.next_spawn, self.boss_wave, self.game_over, last_hit) = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"not a version {SNAPSHOT_VERSION} game snapshot")
+        self.last_hit_by = None if last_hit < 0 else ENEMY_TYPE_NAMES[last_hit]
+        offset = SNAPSHOT_HEADER.size
+        (players, bullets, enemies, powerups, enemy_bullets, particles, colors, layers,
+         self.enemy_bullets.next_id, self.enemy_bullets.clock) = SNAPSHOT_COUNTS.unpack_from(data, offset)
+        if players != len(self.players):
+            raise ValueError(f"snapshot has {players} players, this game {len(self.players)}")
+        offset += SNAPSHOT_COUNTS.size
+        for player in self.players:
+            player.set_state(Player.STATE.unpack_from(data, offset))
+            offset += Player.STATE.size
+        
+        pool = self.bullets
+        pool.clear()
+        for _ in range(bullets):
+            cls = BULLET_KINDS[data[offset]]
+            bullet = pool.take(cls)
+            bullet.set_state(cls.STATE.unpack_from(data, offset + 1))
+            pool.adopt(bullet)
+            offset += 1 + cls.STATE.size
+        pool = self.enemies
+        pool.clear()
+        for _ in range(enemies):
+            enemy = pool.take(Enemy)
+            enemy.set_state(Enemy.STATE.unpack_from(data, offset), self.rng, self.timers)
+            pool.adopt(enemy)
+            offset += Enemy.STATE.size
+        pool = self.powerups
+        pool.clear()
+        for _ in range(powerups):
+            powerup = pool.take(PowerUp)
+            powerup.set_state(PowerUp.STATE.unpack_from(data, offset))
+            pool.adopt(powerup)
+            offset += PowerUp.STATE.size
+            
+        counts = iter(SNAPSHOT_STATS.unpack_from(data, offset))
+        offset += SNAPSHOT_STATS.size
+        self.stats = {
+            "kills": Counter({name: n for name, n in zip(ENEMY_TYPE_NAMES, counts) if n}),
+            "deaths": Counter({name: n for name, n in zip(ENEMY_TYPE_NAMES + [None], counts) if n}),
+            "powerups": Counter({name: n for name, n in zip(POWERUP_TYPE_NAMES, counts) if n}),
+        }
+        if seed != self.seed:
+            self.seed = seed
+            self.starfield = Starfield(random.Random(seed), self.star_count)
+        values = RANDOM_STATE.unpack_from(data, offset)
+        offset += RANDOM_STATE.size
+        self.rng.setstate((3, values[:625], values[626] if values[625] else None))
+        state_hi, state_lo, inc_hi, inc_lo, has_uint32, uinteger = NUMPY_RNG_STATE.unpack_from(data, offset)
+        offset += NUMPY_RNG_STATE.size
+        self.particles.rng.bit_generator.state = {
+            "bit_generator": "PCG64",
+            "state": {"state": state_hi << 64 | state_lo, "inc": inc_hi << 64 | inc_lo},
+            "has_uint32": int(has_uint32),
+            "uinteger": uinteger,
+        }
+        self.starfield.offsets[:] = struct.unpack_from(f"<{layers}d", data, offset)
+        self.held_hud = None
+        offset += layers * 8
+        
+        field = self.enemy_bullets
+        for engine, n in ((field, enemy_bullets), (self.particles, particles)):
+            for arr in engine.arrays:
+                dtype = snapshot_dtype(arr)
+                arr[:n] = np.frombuffer(data, dtype, n, offset)
+                offset += n * dtype.itemsize
+            engine.count = n
+        field.high_water = max(field.high_water, enemy_bullets)
+        
+        # Particle colors are palette indices; map them onto this game's palette
+        palette = [tuple(data[offset + i * 3:offset + i * 3 + 3]) for i in range(colors)]
+        if particles:
+            mapping = np.array([self.particles.color_id(color) for color in palette], dtype=np.intp)
+            self.particles.color[:particles] = mapping[self.particles.color[:particles]]
+            
+        # Deadlines come back with their owners; put them back on the wheel
+        timers = self.timers
+        timers.clear(self.frame)
+        timers.resume(self, "next_spawn")
+        for player in self.players:
+            timers.resume(player, "power_until")
+        for enemy in self.enemies:
+            timers.resume(enemy, "next_shot")
+        self.pending_actions = 0
+        self.partner_actions[:] = [0] * len(self.partner_actions)
+        
+    def apply_quality(self):
+        quality = self.governor.quality
+        self.particles.density = quality.particles
+        self.particles.life = quality.particle_life
+        
     def spawn_enemies(self):
-        if self.wave_timer <= 0 and self.enemies_spawned < self.enemies_to_spawn:
+        # Runs when next_spawn comes due
+        if self.enemies_spawned < self.enemies_to_spawn:
             if self.wave % 5 == 0:  # Boss every 5 waves
                 if not self.boss_wave:
-                    self.enemies.append(Enemy("boss"))
+                    self.enemies.spawn(Enemy, "boss", self.rng, self.timers)
                     self.boss_wave = True
                     self.enemies_spawned = self.enemies_to_spawn
             else:
-                enemy_types = ["basic", "fast", "tank"]
-                weights = [0.5, 0.3, 0.2]
-                enemy_type = random.choices(enemy_types, weights=weights)[0]
-                self.enemies.append(Enemy(enemy_type))
+                enemy_type = self.rng.choices(SPAWN_TYPES, weights=SPAWN_WEIGHTS)[0]
+                self.enemies.spawn(Enemy, enemy_type, self.rng, self.timers)
                 self.enemies_spawned += 1
-                self.wave_timer = 30  # Small delay between spawns
+                self.next_spawn = self.timers.after(30, self, "next_spawn")  # Small delay between spawns
                 
     def spawn_powerup(self, x, y):
-        types = ["health", "weapon", "shield", "laser"]
-        weights = [0.4, 0.3, 0.2, 0.1]
-        power_type = random.choices(types, weights=weights)[0]
-        self.powerups.append(PowerUp(x, y, power_type))
+        power_type = self.rng.choices(DROP_TYPES, weights=DROP_WEIGHTS)[0]
+        self.powerups.spawn(PowerUp, x, y, power_type)
+        
+    def use_grid(self, pairs):
+        # Whether a collision pass testing about this many pairs goes through
+        # a spatial hash
+        if self.collision_mode == "auto":
+            return pairs >= COLLISION_GRID_PAIRS
+        return self.collision_mode == "grid"
+        
+    def broad_phase(self, grid, objects, x, y, width, height):
+        # Candidate indices into objects (all of them without a grid); the
+        # AABB test below decides hits
+        if grid is not None:
+            return grid.query(x, y, width, height)
+        return range(len(objects))
+        
+    def pool_stats(self):
+        stats = {pool.name: pool.stats() for pool in self.pools}
+        stats["enemy_bullets"] = self.enemy_bullets.stats()
+        stats["timers"] = self.timers.stats()
+        stats["text_cache"] = self.hud.stats()
+        return stats
+        
+    def pool_rows(self):
+        # pool_stats() and the next timer due, as (label, value) rows for the
+        # F3 overlay and the sim report; live counts are left to the profiler
+        rows = []
+        for name, stats in self.pool_stats().items():
+            if "allocations" in stats:
+                rows.append((f"{name} pool", f"peak {stats['high_water']}, {stats['allocations']} new, "
+                                             f"{stats['allocations_avoided']} reused"))
+            elif "capacity" in stats:
+                rows.append((name, f"peak {stats['high_water']} of {stats['capacity']}"))
+            elif "fired" in stats:
+                rows.append(("timer wheel", f"{stats['scheduled']} queued, {stats['fired']} fired, "
+                                            f"{stats['stale']} stale"))
+            elif stats["hits"] + stats["misses"]:  # skipped when nothing was drawn
+                hit_rate = stats["hits"] / (stats["hits"] + stats["misses"])
+                rows.append(("text cache", f"{stats['labels']} labels, {hit_rate:.0%} hits"))
+        pending = self.timers.pending()
+        if pending:
+            frame, owner, event = pending[0]
+            rows.append(("next timer", f"{event} in {frame - self.timers.now} frames"))
+        return rows
+        
+    def destroy_enemy(self, enemy):
+        self.enemies.kill(enemy)
+        self.player.score += enemy.kind.score_value
+        self.stats["kills"][enemy.type] += 1
+        
+        # Create explosion particles
+        self.particles.emit(enemy.x + enemy.width//2,
+                            enemy.y + enemy.height//2,
+                            enemy.kind.color, 20)
+        
+        # Chance to spawn powerup
+        if self.rng.random() < 0.2:
+            self.spawn_powerup(
+                enemy.x + enemy.width//2,
+                enemy.y + enemy.height//2
+            )
         
     def check_collisions(self):
+        players = self.active_players()
+        enemies = self.enemies.items
+        enemy_grid = None
+        if self.use_grid((len(self.bullets) + len(players)) * len(self.enemies)):
+            enemy_grid = self.enemy_grid
+            enemy_grid.build(enemies)
+        
         # Player bullets vs enemies
-        for bullet in self.bullets[:]:
-            for enemy in self.enemies[:]:
-                if (bullet.x < enemy.x + enemy.width and
-                    bullet.x + bullet.width > enemy.x and
-                    bullet.y < enemy.y + enemy.height and
-                    bullet.y + bullet.height > enemy.y):
-                    
+        for bullet in self.bullets:
+            if not bullet.alive:
+                continue
+            for i in self.broad_phase(enemy_grid, enemies, bullet.x, bullet.y,
+                                      bullet.width, bullet.height):
+                enemy = enemies[i]
+                if enemy.alive and rects_overlap(bullet, enemy):
                     if enemy.take_damage(bullet.damage):
                         # Enemy destroyed
-                        self.player.score += enemy.score_value
-                        self.enemies.remove(enemy)
-                        
-                        # Create explosion particles
-                        for _ in range(20):
-                            self.particles.append(Particle(
-                                enemy.x + enemy.width//2,
-                                enemy.y + enemy.height//2,
-                                enemy.color
-                            ))
-                        
-                        # Chance to spawn powerup
-                        if random.random() < 0.2:
-                            self.spawn_powerup(
-                                enemy.x + enemy.width//2,
-                                enemy.y + enemy.height//2
-                            )
-                    
-                    if bullet in self.bullets:
-                        self.bullets.remove(bullet)
+                        self.destroy_enemy(enemy)
+                    self.bullets.kill(bullet)
                     break
                     
-        # Enemy bullets vs player
-        for bullet in self.enemy_bullets[:]:
-            if (bullet.x < self.player.x + self.player.width and
-                bullet.x + bullet.width > self.player.x and
-                bullet.y < self.player.y + self.player.height and
-                bullet.y + bullet.height > self.player.y):
-                
-                if self.player.take_damage(bullet.damage):
+        # Enemy bullets vs players
+        enemy_bullets = self.enemy_bullets
+        for player in players:
+            hits = enemy_bullets.hits(player.x, player.y, player.width, player.height)
+            for i in hits:
+                if player.take_damage(int(enemy_bullets.damage[i])):
+                    self.last_hit_by = enemy_bullets.type_names[enemy_bullets.kind[i]]
                     # Create hit particles
-                    for _ in range(10):
-                        self.particles.append(Particle(
-                            self.player.x + self.player.width//2,
-                            self.player.y + self.player.height//2,
-                            RED
-                        ))
-                
-                if bullet in self.enemy_bullets:
-                    self.enemy_bullets.remove(bullet)
+                    self.particles.emit(player.x + player.width//2,
+                                        player.y + player.height//2,
+                                        RED, 10)
+            enemy_bullets.kill(hits)
                     
         # Laser vs enemies
         for bullet in self.bullets:
-            if isinstance(bullet, LaserBeam):
-                for enemy in self.enemies[:]:
-                    if (bullet.x < enemy.x + enemy.width and
+            if bullet.alive and isinstance(bullet, LaserBeam):
+                if enemy_grid is not None:
+                    candidates = enemy_grid.query_column(bullet.x, bullet.width)
+                else:
+                    candidates = range(len(enemies))
+                for i in candidates:
+                    enemy = enemies[i]
+                    if (enemy.alive and
+                        bullet.x < enemy.x + enemy.width and
                         bullet.x + bullet.width > enemy.x):
                         
                         if enemy.take_damage(bullet.damage):
                             # Enemy destroyed
-                            self.player.score += enemy.score_value
-                            self.enemies.remove(enemy)
-                            
-                            for _ in range(20):
-                                self.particles.append(Particle(
-                                    enemy.x + enemy.width//2,
-                                    enemy.y + enemy.height//2,
-                                    enemy.color
-                                ))
-                            
-                            if random.random() < 0.2:
-                                self.spawn_powerup(
-                                    enemy.x + enemy.width//2,
-                                    enemy.y + enemy.height//2
-                                )
-        
-        # Player vs enemies
-        for enemy in self.enemies[:]:
-            if (self.player.x < enemy.x + enemy.width and
-                self.player.x + self.player.width > enemy.x and
-                self.player.y < enemy.y + enemy.height and
-                self.player.y + self.player.height > enemy.y):
-                
-                if self.player.take_damage(30):
-                    for _ in range(15):
-                        self.particles.append(Particle(
-                            self.player.x + self.player.width//2,
-                            self.player.y + self.player.height//2,
-                            RED
-                        ))
-                
-                if enemy.take_damage(50):
-                    self.player.score += enemy.score_value
-                    self.enemies.remove(enemy)
+                            self.destroy_enemy(enemy)
+        
+        # Players vs enemies
+        for player in players:
+            for i in self.broad_phase(enemy_grid, enemies, player.x, player.y,
+                                      player.width, player.height):
+                enemy = enemies[i]
+                if enemy.alive and rects_overlap(player, enemy):
                     
-                    for _ in range(20):
-                        self.particles.append(Particle(
-                            enemy.x + enemy.width//2,
-                            enemy.y + enemy.height//2,
-                            enemy.color
-                        ))
-                        
-                    if random.random() < 0.2:
-                        self.spawn_powerup(
-                            enemy.x + enemy.width//2,
-                            enemy.y + enemy.height//2
-                        )
-        
-        # Player vs powerups
-        for powerup in self.powerups[:]:
-            if (self.player.x < powerup.x + powerup.width and
-                self.player.x + self.player.width > powerup.x and
-                self.player.y < powerup.y + powerup.height and
-                self.player.y + self.player.height > powerup.y):
-                
-                powerup.apply(self.player)
-                self.powerups.remove(powerup)
-                
-                # Create collect particles
-                for _ in range(15):
-                    self.particles.append(Particle(
-                        powerup.x, powerup.y, powerup.color
-                    ))
+                    if player.take_damage(30):
+                        self.last_hit_by = enemy.type
+                        self.particles.emit(player.x + player.width//2,
+                                            player.y + player.height//2,
+                                            RED, 15)
+                    
+                    if enemy.take_damage(50):
+                        self.destroy_enemy(enemy)
+        
+        # Players vs powerups (includes any spawned by kills above)
+        powerups = self.powerups.items
+        powerup_grid = None
+        if self.use_grid(len(players) * len(self.powerups)):
+            powerup_grid = self.powerup_grid
+            powerup_grid.build(powerups)
+        for player in players:
+            for i in self.broad_phase(powerup_grid, powerups, player.x, player.y,
+                                      player.width, player.height):
+                powerup = powerups[i]
+                if powerup.alive and rects_overlap(player, powerup):
+                    powerup.apply(player)
+                    self.powerups.kill(powerup)
+                    self.stats["powerups"][powerup.type] += 1
+                    
+                    # Create collect particles
+                    self.particles.emit(powerup.x, powerup.y, powerup.color, 15)
     
     def update(self):
         if not self.game_over:
-            # Update player
-            keys = pygame.key.get_pressed()
-            self.player.move(keys)
-            self.player.update()
+            prof = self.profiler if self.profiler.enabled else None
+            if prof:
+                prof.start()
+            self.frame += 1
+            if self.interpolate:
+                self.remember_positions()
+            actions = self.input_source(self) | self.pending_actions
+            self.pending_actions = 0
+            if self.recorder is not None:
+                self.recorder.record(actions)
+            
+            seats = zip(self.players, [actions] + self.partner_actions)
+            inputs = [(player, actions) for player, actions in seats if player.lives > 0]
+            
+            # Single shot, then move
+            for player, actions in inputs:
+                if actions & ACTION_SHOT:
+                    player.shoot(self.bullets)
+                player.move(actions)
+            
+            # Timers tick here, where the player's countdowns always did;
+            # what comes due is handled at its usual place in the frame
+            due = self.timers.advance(self.frame)
+            for player in due.get("power_until", ()):
+                player.power_down()
             
             # Auto-shoot when holding space
-            if keys[pygame.K_SPACE]:
-                self.player.shoot(self.bullets)
+            for player, actions in inputs:
+                if actions & ACTION_FIRE:
+                    player.shoot(self.bullets)
+            if prof:
+                prof.mark("update.player")
             
             # Update bullets
-            for bullet in self.bullets[:]:
-                bullet.update()
+            step = self.timers.step
+            for bullet in self.bullets:
+                bullet.update(step)
                 if hasattr(bullet, 'is_off_screen') and bullet.is_off_screen():
-                    self.bullets.remove(bullet)
+                    self.bullets.kill(bullet)
                 elif hasattr(bullet, 'is_active') and not bullet.is_active():
-                    self.bullets.remove(bullet)
+                    self.bullets.kill(bullet)
+            if prof:
+                prof.mark("update.bullets")
             
             # Update enemy bullets
-            for bullet in self.enemy_bullets[:]:
-                bullet.update()
-                if bullet.is_off_screen():
-                    self.enemy_bullets.remove(bullet)
+            self.enemy_bullets.update()
+            if prof:
+                prof.mark("update.enemy_bullets")
             
-            # Update enemies
-            for enemy in self.enemies[:]:
+            # Update enemies; due shots go in pool order, before culling
+            for enemy in self.enemies:
                 enemy.update()
-                enemy.shoot(self.enemy_bullets)
+            shooters = due.get("next_shot")
+            if shooters:
+                shooters.sort(key=lambda enemy: enemy.serial)
+                for enemy in shooters:
+                    if enemy.alive:
+                        enemy.shoot(self.enemy_bullets)
+            for enemy in self.enemies:
                 if enemy.is_off_screen():
-                    self.enemies.remove(enemy)
+                    self.enemies.kill(enemy)
+            if prof:
+                prof.mark("update.enemies")
             
             # Update powerups
-            for powerup in self.powerups[:]:
-                powerup.update()
+            for powerup in self.powerups:
+                powerup.update(step)
                 if powerup.is_off_screen():
-                    self.powerups.remove(powerup)
+                    self.powerups.kill(powerup)
+            if prof:
+                prof.mark("update.powerups")
             
             # Update particles
-            for particle in self.particles[:]:
-                particle.update()
-                if particle.is_dead():
-                    self.particles.remove(particle)
+            self.particles.update()
+            if prof:
+                prof.mark("update.particles")
             
             # Update starfield
-            self.starfield.update()
+            self.starfield.update(step)
+            if prof:
+                prof.mark("update.starfield")
             
             # Spawn logic
-            if self.wave_timer > 0:
-                self.wave_timer -= 1
-            
-            self.spawn_enemies()
+            if "next_spawn" in due:
+                self.spawn_enemies()
             
             # Check if wave is complete
             if (len(self.enemies) == 0 and 
@@ -652,135 +2337,2081 @@ class Game:
                 self.wave += 1
                 self.enemies_to_spawn = min(20, 5 + self.wave * 2)
                 self.enemies_spawned = 0
-                self.wave_timer = 180  # 3 second break between waves
+                self.next_spawn = self.timers.after(180, self, "next_spawn")  # 3 second break between waves
+            if prof:
+                prof.mark("update.spawn")
             
             # Check collisions
             self.check_collisions()
             
-            # Check game over
-            if self.player.health <= 0:
-                self.player.lives -= 1
-                if self.player.lives <= 0:
-                    self.game_over = True
-                else:
-                    self.player.health = self.player.max_health
-                    self.player.invincible = 180  # 3 seconds respawn invincibility
+            # Check game over; in co-op once every player is out of lives
+            for player in self.active_players():
+                if player.health <= 0:
+                    player.lives -= 1
+                    self.stats["deaths"][self.last_hit_by] += 1
+                    if player.lives <= 0:
+                        if not self.active_players():
+                            self.game_over = True
+                            if self.recorder is not None:
+                                self.recorder.save(self)
+                    else:
+                        player.health = player.max_health
+                        player.invincible_until = self.timers.now + self.timers.ticks(180)  # 3 seconds respawn invincibility
+            
+            # Drop everything killed this frame
+            for pool in self.pools:
+                pool.compact()
+            if prof:
+                prof.mark("update.collisions")
     
-    def draw(self):
-        self.screen.fill(BLACK)
+    def active_players(self):
+        # Players still in the game (a co-op partner out of lives sits out)
+        return [player for player in self.players if player.lives > 0]
         
-        # Draw starfield
-        self.starfield.draw(self.screen)
+    def moving_entities(self):
+        yield from self.players
+        for pool in self.pools:
+            yield from pool
+            
+    def remember_positions(self):
+        for entity in self.moving_entities():
+            entity.prev_x = entity.x
+            entity.prev_y = entity.y
+        self.enemy_bullets.remember()
+            
+    def blend_positions(self, alpha):
+        # Place entities alpha of the way from their previous tick to the
+        # current one; returns what restore_positions needs to undo it
+        saved = []
+        for entity in self.moving_entities():
+            x = entity.x
+            y = entity.y
+            saved.append((entity, x, y))
+            entity.x = entity.prev_x + (x - entity.prev_x) * alpha
+            entity.y = entity.prev_y + (y - entity.prev_y) * alpha
+        return saved, self.enemy_bullets.blend(alpha)
+        
+    def restore_positions(self, saved):
+        saved, bullets = saved
+        for entity, x, y in saved:
+            entity.x = x
+            entity.y = y
+        self.enemy_bullets.restore(bullets)
+    
+    def step(self, frames=1):
+        # Advance the simulation without drawing or throttling; stops early
+        # on game over and returns the number of frames simulated
+        for i in range(frames):
+            if self.game_over:
+                return i
+            self.update()
+            if self.profiler.enabled:
+                self.profiler.end_frame(self)
+        return frames
+    
+    def draw(self, alpha=1.0):
+        if self.pipeline is not None:
+            self.pipeline.submit(self.capture_frame(alpha))
+        else:
+            self.render_frame(self.capture_frame(alpha))
+            
+    def hud_state(self):
+        player = self.player
+        return HudState(player.score, self.wave, player.lives, player.weapon_type,
+                        player.power_level, player.special_ammo, player.power_time,
+                        self.game_over)
+                        
+    def capture_frame(self, alpha=1.0):
+        # Copy out everything render_frame needs, so the frame can be drawn
+        # while the simulation moves on
+        saved = None
+        if self.interpolate and alpha < 1.0:
+            saved = self.blend_positions(alpha)
+        
+        prof = self.profiler if self.profiler.enabled else None
+        if prof:
+            prof.start()
+        
+        # Batches come out in canvas pixels
+        quality = self.governor.quality
+        scale = self.render_scale
+        sprites = self.sprites
+        bullets, lasers = sprites.batch(self.bullets)
+        enemies, _ = sprites.batch(self.enemies)
+        health_bars = []
+        if quality.health_bars:
+            for enemy in self.enemies:
+                if enemy.type == "boss":
+                    health_bars.extend(scale_shapes(enemy.health_bar(), scale))
+        powerups, _ = sprites.batch(self.powerups)
+        player = []
+        player_bars = []
+        for ship in self.active_players():
+            batch, bars = ship.frame_parts(sprites)
+            player.extend(batch)
+            player_bars.extend(bars)
+        
+        # The dimmest star layers go first
+        stars = self.starfield.offsets
+        skip = len(stars) - quality.star_layers
+        if skip > 0:
+            stars = [None] * skip + stars[skip:]
+            
+        # Between refreshes the HUD keeps showing the state it last took
+        hud = self.hud_state()
+        held = self.held_hud
+        if held is not None and held.game_over == hud.game_over and self.frame < self.hud_due:
+            hud = held
+        else:
+            self.held_hud = hud
+            self.hud_due = self.frame + quality.hud_every
+            
+        profile = None
+        if self.profiler.overlay:
+            # Refreshed with the profiler's rows, for the same reason
+            if self.profiler.frames % 15 == 1 or self.held_pool_rows is None:
+                self.held_pool_rows = self.pool_rows()
+            profile = self.profiler.overlay_rows() + self.governor.overlay_rows() + self.held_pool_rows
+        frame = Frame(
+            stars=tuple(stars),
+            bullets=bullets,
+            lasers=lasers,
+            enemy_bullets=self.enemy_bullets.batch(scale),
+            enemies=enemies,
+            health_bars=health_bars,
+            powerups=powerups,
+            particles=self.particles.batch(scale),
+            player=player,
+            player_bars=player_bars,
+            hud=hud,
+            profile=profile,
+        )
+        
+        if saved is not None:
+            self.restore_positions(saved)
+        if prof:
+            prof.mark("draw.capture")
+        return frame
+        
+    def render_frame(self, frame):
+        # Draws a captured frame; in pipelined mode this runs on the render
+        # thread and must not touch the live game state or the display,
+        # which the pipeline presents from the main thread
+        prof = self.profiler if self.profiler.enabled and self.pipeline is None else None
+        
+        screen = self.screen
+        rects = None
+        if self.dirty is not None:
+            rects = self.dirty.begin(screen, self.draw_static_layer)
+        else:
+            self.draw_background(screen, frame.stars)
+        if prof:
+            prof.mark("draw.background")
         
+        self.draw_entities(screen, frame, rects, prof)
+        
+        # Draw UI
+        self.draw_ui(frame.hud, rects)
+        
+        # Draw game over screen
+        if frame.hud.game_over:
+            self.draw_game_over(frame.hud, rects)
+        
+        # Draw profiler overlay
+        if frame.profile is not None:
+            self.draw_profiler(frame.profile, rects)
+        if prof:
+            prof.mark("draw.hud")
+        
+        if self.capture is not None:
+            self.capture.grab(screen)
+            if prof:
+                prof.mark("draw.video")
+        
+        if self.pipeline is None:
+            self.present_frame()
+        if prof:
+            prof.mark("draw.present")
+            
+    def present_frame(self):
+        # The drawn canvas to the display; main thread only
+        if self.headless:
+            return
+        if self.dirty is not None:
+            self.dirty.present(self.screen)
+        else:
+            if self.screen is not self.window:
+                self.present_scaled()
+            pygame.display.flip()
+            
+    def present_scaled(self):
+        # One scale of the canvas into the window, letterboxed to keep the
+        # aspect ratio
+        window = self.window
+        size = window.get_size()
+        if self.view is None or self.view[0] != size:
+            fit = min(size[0] / SCREEN_WIDTH, size[1] / SCREEN_HEIGHT)
+            area = pygame.Rect(0, 0, max(1, round(SCREEN_WIDTH * fit)), max(1, round(SCREEN_HEIGHT * fit)))
+            area.center = (size[0] // 2, size[1] // 2)
+            window.fill(BLACK)
+            self.view = (size, window.subsurface(area))
+        target = self.view[1]
+        if self.smooth:
+            pygame.transform.smoothscale(self.screen, target.get_size(), target)
+        else:
+            pygame.transform.scale(self.screen, target.get_size(), target)
+            
+    def draw_entities(self, screen, frame, rects=None, prof=None):
         # Draw bullets
-        for bullet in self.bullets:
-            bullet.draw(self.screen)
+        blit_batch(screen, frame.bullets, rects)
+        fill_shapes(screen, frame.lasers, rects)
+        if prof:
+            prof.mark("draw.bullets")
         
         # Draw enemy bullets
-        for bullet in self.enemy_bullets:
-            bullet.draw(self.screen)
+        blit_batch(screen, frame.enemy_bullets, rects)
+        if prof:
+            prof.mark("draw.enemy_bullets")
         
         # Draw enemies
-        for enemy in self.enemies:
-            enemy.draw(self.screen)
+        blit_batch(screen, frame.enemies, rects)
+        fill_shapes(screen, frame.health_bars, rects)
+        if prof:
+            prof.mark("draw.enemies")
         
         # Draw powerups
-        for powerup in self.powerups:
-            powerup.draw(self.screen)
+        blit_batch(screen, frame.powerups, rects)
+        if prof:
+            prof.mark("draw.powerups")
         
         # Draw particles
-        for particle in self.particles:
-            particle.draw(self.screen)
+        blit_batch(screen, frame.particles, rects)
+        if prof:
+            prof.mark("draw.particles")
         
         # Draw player
-        self.player.draw(self.screen)
-        
-        # Draw UI
-        self.draw_ui()
+        blit_batch(screen, frame.player, rects)
+        fill_shapes(screen, frame.player_bars, rects)
+        if prof:
+            prof.mark("draw.player")
+                
+    def draw_background(self, surface, stars=None):
+        surface.fill(BLACK)
         
-        # Draw game over screen
-        if self.game_over:
-            self.draw_game_over()
+        # Draw starfield
+        self.starfield.draw(surface, stars)
         
-        pygame.display.flip()
+    def draw_static_layer(self, surface):
+        # Background for dirty-rect mode, with the controls help baked in
+        self.draw_background(surface)
+        surface.blits(self.hud.controls_layer(self.font_small, self.render_scale), doreturn=False)
     
-    def draw_ui(self):
+    def draw_ui(self, state, rects=None):
+        hud = self.hud
+        labels = []
+        
         # Score
-        score_text = self.font_medium.render(f"Score: {self.player.score}", True, WHITE)
-        self.screen.blit(score_text, (10, 10))
+        score_text = hud.text("score", self.font_medium, f"Score: {state.score}", WHITE)
+        labels.append((score_text, self.at(10, 10)))
         
         # Wave
-        wave_text = self.font_medium.render(f"Wave: {self.wave}", True, WHITE)
-        self.screen.blit(wave_text, (10, 50))
+        wave_text = hud.text("wave", self.font_medium, f"Wave: {state.wave}", WHITE)
+        labels.append((wave_text, self.at(10, 50)))
         
         # Lives
-        lives_text = self.font_medium.render(f"Lives: {self.player.lives}", True, WHITE)
-        self.screen.blit(lives_text, (SCREEN_WIDTH - 120, 10))
+        lives_text = hud.text("lives", self.font_medium, f"Lives: {state.lives}", WHITE)
+        labels.append((lives_text, self.at(SCREEN_WIDTH - 120, 10)))
         
         # Weapon status
-        if self.player.weapon_type == "normal":
-            weapon_text = self.font_small.render(f"Weapon: Level {self.player.power_level}", True, YELLOW)
+        if state.weapon_type == "normal":
+            weapon_text = hud.text("weapon", self.font_small,
+                                   f"Weapon: Level {state.power_level}", YELLOW)
         else:
-            weapon_text = self.font_small.render(f"Weapon: LASER ({self.player.special_ammo})", True, ORANGE)
-        self.screen.blit(weapon_text, (SCREEN_WIDTH - 150, 50))
+            weapon_text = hud.text("weapon", self.font_small,
+                                   f"Weapon: LASER ({state.special_ammo})", ORANGE)
+        labels.append((weapon_text, self.at(SCREEN_WIDTH - 150, 50)))
         
         # Powerup timer
-        if self.player.power_time > 0:
-            timer_text = self.font_small.render(f"Power: {self.player.power_time//60}s", True, GREEN)
-            self.screen.blit(timer_text, (SCREEN_WIDTH - 150, 80))
-        
-        # Controls help
-        controls = [
-            "CONTROLS:",
-            "Arrow Keys - Move",
-            "Space - Shoot (Hold)",
-            "Z - Single Shot"
-        ]
+        if state.power_time > 0:
+            timer_text = hud.text("power", self.font_small,
+                                  f"Power: {state.power_time//60}s", GREEN)
+            labels.append((timer_text, self.at(SCREEN_WIDTH - 150, 80)))
         
-        for i, line in enumerate(controls):
-            control_text = self.font_small.render(line, True, (150, 150, 150))
-            self.screen.blit(control_text, (SCREEN_WIDTH - 200, SCREEN_HEIGHT - 120 + i * 25))
+        if self.dirty is None:
+            # Controls help
+            labels.extend(hud.controls_layer(self.font_small, self.render_scale))
+        else:
+            # Share of the screen the last frame sent to the display
+            dirty_text = hud.text("dirty", self.font_small,
+                                  f"Updated: {self.dirty.fraction:.0%}", (150, 150, 150))
+            labels.append((dirty_text, self.at(10, SCREEN_HEIGHT - 30)))
+        
+        if rects is None:
+            self.screen.blits(labels, doreturn=False)
+        else:
+            rects.extend(self.screen.blits(labels))
     
-    def draw_game_over(self):
-        # Semi-transparent overlay
-        overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, 200))
-        self.screen.blit(overlay, (0, 0))
+    def draw_game_over(self, state, rects=None):
+        hud = self.hud
+        rect = self.screen.blit(hud.game_over_overlay(self.screen.get_size()), (0, 0))
+        if rects is not None:
+            rects.append(rect)
         
         # Game over text
-        game_over_text = self.font_large.render("GAME OVER", True, RED)
-        self.screen.blit(game_over_text, 
-                        (SCREEN_WIDTH//2 - game_over_text.get_width()//2, 
-                         SCREEN_HEIGHT//2 - 100))
+        game_over_text = hud.text("game_over", self.font_large, "GAME OVER", RED)
+        self.blit_centered(game_over_text, SCREEN_HEIGHT//2 - 100)
         
         # Final score
-        score_text = self.font_medium.render(f"Final Score: {self.player.score}", True, WHITE)
-        self.screen.blit(score_text, 
-                        (SCREEN_WIDTH//2 - score_text.get_width()//2, 
-                         SCREEN_HEIGHT//2 - 30))
+        score_text = hud.text("final_score", self.font_medium,
+                              f"Final Score: {state.score}", WHITE)
+        self.blit_centered(score_text, SCREEN_HEIGHT//2 - 30)
         
         # Wave reached
-        wave_text = self.font_medium.render(f"Waves Survived: {self.wave}", True, WHITE)
-        self.screen.blit(wave_text, 
-                        (SCREEN_WIDTH//2 - wave_text.get_width()//2, 
-                         SCREEN_HEIGHT//2 + 10))
+        wave_text = hud.text("waves_survived", self.font_medium,
+                             f"Waves Survived: {state.wave}", WHITE)
+        self.blit_centered(wave_text, SCREEN_HEIGHT//2 + 10)
         
         # Restart instructions
-        restart_text = self.font_medium.render("Press SPACE to restart or ESC to quit", True, GREEN)
-        self.screen.blit(restart_text, 
-                        (SCREEN_WIDTH//2 - restart_text.get_width()//2, 
-                         SCREEN_HEIGHT//2 + 80))
+        restart_text = hud.text("restart", self.font_medium,
+                                "Press SPACE to restart or ESC to quit", GREEN)
+        self.blit_centered(restart_text, SCREEN_HEIGHT//2 + 80)
+        
+    def blit_centered(self, text, y):
+        # Centred horizontally at logical height y
+        x, y = self.at(SCREEN_WIDTH//2, y)
+        self.screen.blit(text, (x - text.get_width()//2, y))
+    
+    def draw_profiler(self, rows, rects=None):
+        # The rows only change a few times a second, so the panel is kept
+        # until they do
+        if self.hud.panel is None or self.hud.panel[0] != rows:
+            width, height = self.at(400, len(rows) * 20 + 10)
+            panel = pygame.Surface((round(width), round(height)), pygame.SRCALPHA)
+            panel.fill((0, 0, 0, 170))
+            for i, (name, value) in enumerate(rows):
+                panel.blit(self.hud.text(f"profile{i}", self.font_small, name, CYAN), self.at(8, 5 + i * 20))
+                panel.blit(self.hud.text(f"profile{i}v", self.font_small, value, WHITE),
+                           self.at(170, 5 + i * 20))
+            self.hud.panel = (rows, panel)
+        rect = self.screen.blit(self.hud.panel[1], self.at(10, 90))
+        if rects is not None:
+            rects.append(rect)
     
     def run(self):
+        # Fixed-timestep loop: the simulation always advances in 1/sim_rate
+        # ticks; a slow frame runs several ticks (at most MAX_CATCH_UP) before
+        # the next draw instead of slowing the game down
+        lag = 1000.0 / self.sim_rate
         while self.running:
+            tick_ms = 1000.0 / self.sim_rate
+            started = time.perf_counter()
             self.handle_events()
-            self.update()
-            self.draw()
-            self.clock.tick(FPS)
+            ticks = 0
+            while lag >= tick_ms and ticks < MAX_CATCH_UP:
+                if self.frame_limit is not None and self.frame >= self.frame_limit:
+                    self.running = False
+                    break
+                self.update()
+                lag -= tick_ms
+                ticks += 1
+            if lag >= tick_ms:
+                # Too far behind to catch up; drop the backlog
+                lag %= tick_ms
+            self.draw(lag / tick_ms)
+            if self.governor.observe((time.perf_counter() - started) * 1000.0, self.frame):
+                self.apply_quality()
+            if self.profiler.enabled:
+                self.profiler.end_frame(self)
+            lag += self.clock.tick(self.draw_fps)
         
-        pygame.quit()
-        sys.exit()
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            print(self.pipeline.summary())
+        if self.governor.adaptive:
+            print(self.governor.summary())
+        if self.recorder is not None and not self.recorder.saved:
+            self.recorder.save(self)
+        if self.capture is not None:
+            print(self.capture.close())
+        self.profiler.close()
+        quit_pygame()
+
+# Capture ring layout in shared memory: CAPTURE_RING counters, then per
+# slot (presented frame number, seconds since capture start), then the
+# slots' BGRA pixels. The game advances head after a slot's pixels are in;
+# the encoder advances tail once it has copied a slot out
+CAPTURE_HEAD = 0
+CAPTURE_TAIL = 1
+CAPTURE_RING = 2
+
+def capture_ring(buffer, slots, width, height):
+    # (counters, stamps, pixels) views over a ring buffer; with buffer None,
+    # the bytes the ring needs
+    counters = CAPTURE_RING * 8
+    stamps = slots * 2 * 8
+    size = counters + stamps + slots * height * width * 4
+    if buffer is None:
+        return size
+    return (np.ndarray(CAPTURE_RING, np.int64, buffer),
+            np.ndarray((slots, 2), np.float64, buffer, counters),
+            np.ndarray((slots, height, width, 4), np.uint8, buffer, counters + stamps))
+
+# Capture file: header, then per frame a record and its zlib-compressed
+# RGB rows
+CAPTURE_MAGIC = b"GDCV"
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = struct.Struct("<4sHII")  # magic, version, width, height
+CAPTURE_RECORD = struct.Struct("<QdI")  # presented frame, seconds, compressed bytes
+
+def png_chunk(kind, body):
+    return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+def png_bytes(rgb):
+    # A truecolor PNG of an (height, width, 3) array: unfiltered rows, one IDAT
+    height, width, _ = rgb.shape
+    rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    rows[:, 1:] = rgb.reshape(height, width * 3)
+    return (b"\x89PNG\r\n\x1a\n" +
+            png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) +
+            png_chunk(b"IDAT", zlib.compress(rows.tobytes(), CAPTURE_ZLIB_LEVEL)) +
+            png_chunk(b"IEND", b""))
+
+class CaptureWriter:
+    # Encoded frames to disk: one capture file for "zlib", a numbered PNG
+    # per frame in a folder for "png"
+    def __init__(self, path, fmt, width, height):
+        self.fmt = fmt
+        self.bytes = 0
+        if fmt == "png":
+            self.path = path
+            os.makedirs(path, exist_ok=True)
+            self.file = None
+        else:
+            self.path = path + ".gdcap"
+            self.file = open(self.path, "wb")
+            self.file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, width, height))
+            
+    def encode(self, rgb):
+        if self.fmt == "png":
+            return png_bytes(rgb)
+        return zlib.compress(rgb.tobytes(), CAPTURE_ZLIB_LEVEL)
+        
+    def write(self, frame, seconds, data):
+        if self.file is None:
+            with open(os.path.join(self.path, f"{frame:06d}.png"), "wb") as f:
+                f.write(data)
+        else:
+            self.file.write(CAPTURE_RECORD.pack(frame, seconds, len(data)))
+            self.file.write(data)
+        self.bytes += len(data)
+        
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+def read_capture(path):
+    # (presented frame, seconds, RGB array) for each frame of a capture file
+    with open(path, "rb") as f:
+        magic, version, width, height = CAPTURE_HEADER.unpack(f.read(CAPTURE_HEADER.size))
+        if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+            raise ValueError(f"{path} is not a version {CAPTURE_VERSION} capture")
+        while True:
+            record = f.read(CAPTURE_RECORD.size)
+            if len(record) < CAPTURE_RECORD.size:
+                return
+            frame, seconds, size = CAPTURE_RECORD.unpack(record)
+            rgb = np.frombuffer(zlib.decompress(f.read(size)), np.uint8).reshape(height, width, 3)
+            yield frame, seconds, rgb
+
+def encode_capture(name, slots, width, height, folder, fmt, commands):
+    # FrameCapture's encoder process: takes frames off the ring in order,
+    # writes them out and keeps the last CAPTURE_CLIP_SECONDS of them to
+    # save as a clip on request. Replies to "stop" with its totals once
+    # the ring is empty
+    from multiprocessing import shared_memory
+    memory = shared_memory.SharedMemory(name)
+    counters, stamps, pixels = capture_ring(memory.buf, slots, width, height)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    writer = CaptureWriter(os.path.join(folder, f"capture-{stamp}"), fmt, width, height)
+    recent = deque()
+    encoded = 0
+    clips = 0
+    stopping = False
+    while True:
+        tail = int(counters[CAPTURE_TAIL])
+        waiting = tail < int(counters[CAPTURE_HEAD])
+        if waiting:
+            slot = tail % slots
+            frame, seconds = int(stamps[slot, 0]), float(stamps[slot, 1])
+            rgb = pixels[slot, :, :, 2::-1].copy()
+            counters[CAPTURE_TAIL] = tail + 1  # the slot is free again
+            data = writer.encode(rgb)
+            writer.write(frame, seconds, data)
+            encoded += 1
+            recent.append((frame, seconds, data))
+            while recent[0][1] < seconds - CAPTURE_CLIP_SECONDS:
+                recent.popleft()
+        elif stopping:
+            break
+        if commands.poll(0 if waiting else 0.005):
+            command = commands.recv()
+            if command == "clip":
+                clips += 1
+                clip = CaptureWriter(os.path.join(folder, f"clip-{stamp}-{clips:03d}"), fmt, width, height)
+                for record in recent:
+                    clip.write(*record)
+                clip.close()
+            elif command == "stop":
+                stopping = True
+    writer.close()
+    commands.send((encoded, writer.bytes, clips, writer.path))
+    del counters, stamps, pixels
+    memory.close()
+
+class FrameCapture:
+    # Copies presented frames into a shared-memory ring that a separate
+    # encoder process drains to disk, so drawing never waits on compression.
+    # Each slot is a Surface over its part of the ring (as in PixelObserver),
+    # so a frame is one scale or blit into shared memory. With every slot
+    # still waiting for the encoder a frame is dropped and counted
+    def __init__(self, folder, fmt="zlib", scale=CAPTURE_SCALE, every=CAPTURE_EVERY,
+                 slots=CAPTURE_SLOTS):
+        self.folder = folder
+        self.fmt = fmt
+        self.scale = scale
+        self.every = every
+        self.slots = slots
+        self.presented = 0
+        self.captured = 0
+        self.dropped = 0
+        self.clips = 0
+        self.memory = None
+        self.encoder = None
+        
+    def open(self, screen):
+        # Sizes the ring for frames drawn on screen and starts the encoder
+        from multiprocessing import shared_memory
+        width, height = screen.get_size()
+        self.size = (max(1, round(width * self.scale)), max(1, round(height * self.scale)))
+        width, height = self.size
+        os.makedirs(self.folder, exist_ok=True)
+        try:
+            self.memory = shared_memory.SharedMemory(create=True,
+                                                     size=capture_ring(None, self.slots, width, height))
+            self.counters, self.stamps, self.pixels = capture_ring(self.memory.buf, self.slots, width, height)
+            self.counters[:] = 0
+            self.surfaces = [pygame.image.frombuffer(self.pixels[slot], self.size, "BGRA")
+                             for slot in range(self.slots)]
+            self.direct = screen.get_masks()[:3] == self.surfaces[0].get_masks()[:3]
+            
+            # Spawned, not forked: the child must not inherit the display
+            context = multiprocessing.get_context("spawn")
+            self.commands, commands = context.Pipe()
+            self.encoder = context.Process(target=encode_capture, daemon=True,
+                                           args=(self.memory.name, self.slots, width, height,
+                                                 self.folder, self.fmt, commands))
+            self.encoder.start()
+        except BaseException:
+            self.release()
+            raise
+        self.started = time.perf_counter()
+        
+    def release(self):
+        # Drops every view into the ring, the slot Surfaces included, so the
+        # shared memory can be closed, then removes it
+        self.counters = self.stamps = self.pixels = self.surfaces = None
+        if self.memory is not None:
+            memory = self.memory
+            self.memory = None
+            try:
+                memory.close()
+            finally:
+                memory.unlink()
+                
+    def grab(self, screen):
+        # Called with each presented frame
+        self.presented += 1
+        if self.presented % self.every:
+            return
+        counters = self.counters
+        head = int(counters[CAPTURE_HEAD])
+        if head - int(counters[CAPTURE_TAIL]) >= self.slots:
+            self.dropped += 1
+            return
+        slot = head % self.slots
+        target = self.surfaces[slot]
+        if screen.get_size() == self.size:
+            target.blit(screen, (0, 0))
+        elif self.direct:
+            pygame.transform.scale(screen, self.size, target)
+        else:
+            target.blit(pygame.transform.scale(screen, self.size), (0, 0))
+        self.stamps[slot] = (self.presented, time.perf_counter() - self.started)
+        counters[CAPTURE_HEAD] = head + 1  # published after the pixels
+        self.captured += 1
+        
+    def save_clip(self):
+        # The encoder writes out what it holds of the last CAPTURE_CLIP_SECONDS
+        if not self.encoder.is_alive():
+            print("capture: the encoder has stopped, no clip saved")
+            return
+        try:
+            self.commands.send("clip")
+        except OSError:  # it stopped since the check
+            return
+        self.clips += 1
+        
+    def close(self):
+        # Waits up to CAPTURE_STOP_TIMEOUT for the encoder to finish the
+        # ring; returns a summary line. The ring is removed whatever happens
+        totals = None
+        try:
+            if self.encoder.is_alive():
+                self.commands.send("stop")
+                if self.commands.poll(CAPTURE_STOP_TIMEOUT):
+                    totals = self.commands.recv()
+        except (OSError, EOFError):  # the encoder died on the way
+            pass
+        finally:
+            self.encoder.join(1.0)
+            if self.encoder.is_alive():
+                self.encoder.kill()  # also ends a stopped process, unlike terminate
+                self.encoder.join()
+            self.commands.close()
+            self.release()
+        if totals is None:
+            return (f"capture: the encoder failed (exit code {self.encoder.exitcode}); "
+                    f"{self.captured} frames captured, {self.dropped} dropped")
+        encoded, written, clips, path = totals
+        return (f"capture: {self.captured} frames to {path} ({written / 2**20:.1f} MiB), "
+                f"{self.dropped} dropped, {clips} clips")
+
+def run_capture_export(args):
+    # A capture file as a numbered PNG sequence
+    os.makedirs(args.out, exist_ok=True)
+    count = 0
+    for frame, seconds, rgb in read_capture(args.file):
+        with open(os.path.join(args.out, f"{frame:06d}.png"), "wb") as f:
+            f.write(png_bytes(rgb))
+        count += 1
+    print(f"{count} frames written to {args.out}")
+
+class PixelObserver:
+    # Renders a game offscreen and scales it into a Surface built over a NumPy
+    # array with pygame.image.frombuffer, so the pixels are read straight
+    # from the array with no copy out. The full path draws the frame as
+    # shown; the fast path draws only the entities on black, skipping the
+    # starfield and HUD. Grayscale is computed from the RGB pixels
+    def __init__(self, game, width=PIXEL_OBS_WIDTH, height=PIXEL_OBS_HEIGHT,
+                 fast=False, grayscale=False):
+        self.game = game
+        self.size = (width, height)
+        self.fast = fast
+        self.grayscale = grayscale
+        
+        # "BGRA" matches the default 32-bit surface layout, which
+        # transform.scale needs to write into the target directly
+        self.buffer = np.zeros((height, width, 4), dtype=np.uint8)
+        self.target = pygame.image.frombuffer(self.buffer, self.size, "BGRA")
+        self.rgb = self.buffer[:, :, 2::-1]  # view, not a copy
+        self.luma = np.zeros((height, width), dtype=np.uint16)
+        self.gray = np.zeros((height, width), dtype=np.uint8)
+        self.canvas = pygame.Surface(game.screen.get_size()) if fast else game.screen
+        self.drawn = []  # fast path: areas to clear before the next frame
+        self.direct = self.canvas.get_masks()[:3] == self.target.get_masks()[:3]
+        
+    def observe(self):
+        # The returned array is updated in place by the next call
+        game = self.game
+        frame = game.capture_frame()
+        if self.fast:
+            for rect in self.drawn:
+                self.canvas.fill(BLACK, rect)
+            self.drawn = []
+            game.draw_entities(self.canvas, frame, self.drawn)
+        else:
+            self.canvas = game.screen  # replaced when the game restarts
+            game.render_frame(frame)
+        if self.direct:
+            pygame.transform.scale(self.canvas, self.size, self.target)
+        else:
+            self.target.blit(pygame.transform.scale(self.canvas, self.size), (0, 0))
+        if self.grayscale:
+            np.matmul(self.rgb, LUMA_WEIGHTS, out=self.luma)
+            self.luma >>= 8
+            self.gray[:] = self.luma
+            return self.gray
+        return self.rgb
+
+class VectorEnv:
+    # N headless games stepped in lockstep for training agents. Actions are
+    # input bitmasks; observations, rewards and done flags come back as
+    # arrays with one row per game, and finished games are replaced at once
+    # with a fresh game on the next seed. Observations are feature vectors,
+    # or with pixels="gray"/"rgb" fast-path PixelObserver frames of width x height
+    def __init__(self, num_envs, seed=0, frame_skip=1, max_frames=BATCH_MAX_FRAMES,
+                 death_penalty=DEATH_PENALTY, pixels=None, render_scale=1.0,
+                 width=PIXEL_OBS_WIDTH, height=PIXEL_OBS_HEIGHT):
+        self.num_envs = num_envs
+        self.render_scale = render_scale  # pixel observations draw at this scale first
+        self.width = width
+        self.height = height
+        self.next_seed = seed
+        self.frame_skip = frame_skip
+        self.max_frames = max_frames
+        self.death_penalty = death_penalty
+        self.pixels = pixels
+        self.games = []
+        self.observers = []
+        if pixels == "gray":
+            shape = (num_envs, height, width)
+        elif pixels == "rgb":
+            shape = (num_envs, height, width, 3)
+        else:
+            shape = (num_envs, OBS_SIZE)
+        self.observations = np.zeros(shape, dtype=np.uint8 if pixels else np.float32)
+        self.rewards = np.zeros(num_envs, dtype=np.float32)
+        self.dones = np.zeros(num_envs, dtype=bool)
+        
+    def restart(self, game):
+        game.restart(self.next_seed)
+        self.next_seed += 1
+        
+    def new_game(self):
+        game = Game(headless=True, seed=self.next_seed, render_scale=self.render_scale)
+        self.next_seed += 1
+        if self.pixels:
+            return game, PixelObserver(game, self.width, self.height, fast=True,
+                                       grayscale=self.pixels == "gray")
+        return game, None
+        
+    def reset(self, seed=None):
+        # Games use consecutive seeds from seed, or carry on from the last one
+        if seed is not None:
+            self.next_seed = seed
+        if self.games:
+            for game in self.games:
+                self.restart(game)
+        else:
+            self.games, self.observers = map(list, zip(*(self.new_game() for _ in range(self.num_envs))))
+        for i, game in enumerate(self.games):
+            self.observe(i, game)
+        return self.observations.copy()
+        
+    def step(self, actions):
+        # Returns observations, rewards, dones and one info dict per game;
+        # for a finished game the info holds its final score, wave and
+        # observation, and the observation row is already the new game's
+        actions = np.asarray(actions, dtype=np.intp)
+        infos = [{} for _ in range(self.num_envs)]
+        for i, game in enumerate(self.games):
+            player = game.player
+            score = player.score
+            lives = player.lives
+            action = int(actions[i])
+            for _ in range(self.frame_skip):
+                game.pending_actions = action
+                game.update()
+                if game.game_over:
+                    break
+            self.rewards[i] = (player.score - score) - (lives - player.lives) * self.death_penalty
+            truncated = not game.game_over and game.frame >= self.max_frames
+            done = game.game_over or truncated
+            self.dones[i] = done
+            if done:
+                self.observe(i, game)
+                infos[i] = {"score": player.score, "wave": game.wave, "frames": game.frame,
+                            "truncated": truncated,
+                            "final_observation": self.observations[i].copy()}
+                self.restart(game)
+            self.observe(i, game)
+        return self.observations.copy(), self.rewards.copy(), self.dones.copy(), infos
+        
+    def observe(self, i, game):
+        if self.pixels:
+            self.observations[i] = self.observers[i].observe()
+            return
+        
+        # Positions are relative to the player's centre and scaled by the
+        # screen size; absent enemies and bullets are all zeros
+        obs = self.observations[i]
+        obs[:] = 0.0
+        player = game.player
+        cx = player.x + player.width / 2
+        cy = player.y + player.height / 2
+        obs[0] = cx / SCREEN_WIDTH
+        obs[1] = cy / SCREEN_HEIGHT
+        obs[2] = player.health / player.max_health
+        obs[3] = player.power_level / 3
+        obs[4] = player.weapon_type == "laser"
+        obs[5] = player.invincible > 0
+        
+        # Nearest enemies: dx, dy, speed, health, present
+        enemies = []
+        for enemy in game.enemies:
+            dx = (enemy.x + enemy.width / 2 - cx) / SCREEN_WIDTH
+            dy = (enemy.y + enemy.height / 2 - cy) / SCREEN_HEIGHT
+            enemies.append((dx * dx + dy * dy, dx, dy, enemy.speed / 5,
+                            enemy.health / enemy.kind.max_health))
+        enemies.sort()
+        start = OBS_PLAYER_SIZE
+        for j, (_, dx, dy, speed, health) in enumerate(enemies[:OBS_ENEMIES]):
+            at = start + j * OBS_ENEMY_SIZE
+            obs[at:at + OBS_ENEMY_SIZE] = (dx, dy, speed, health, 1.0)
+            
+        # Nearest enemy bullets: dx, dy, vx, vy, present
+        field = game.enemy_bullets
+        n = field.count
+        if n:
+            dx = (field.x[:n] + field.width[:n] / 2 - cx) / SCREEN_WIDTH
+            dy = (field.y[:n] + field.height[:n] / 2 - cy) / SCREEN_HEIGHT
+            distance = dx * dx + dy * dy
+            nearest = np.argsort(distance, kind="stable")[:OBS_BULLETS]
+            rows = obs[start + OBS_ENEMIES * OBS_ENEMY_SIZE:].reshape(OBS_BULLETS, OBS_BULLET_SIZE)
+            k = len(nearest)
+            rows[:k, 0] = dx[nearest]
+            rows[:k, 1] = dy[nearest]
+            rows[:k, 2] = field.dx[nearest] / 5
+            rows[:k, 3] = field.dy[nearest] / 5
+            rows[:k, 4] = 1.0
+
+def run_env(args):
+    # Step throughput of VectorEnv under uniformly random actions
+    width, height = args.obs_size
+    env = VectorEnv(args.envs, seed=args.seed, frame_skip=args.frame_skip, pixels=args.pixels,
+                    render_scale=args.render_scale, width=width, height=height)
+    env.reset()
+    rng = np.random.default_rng(args.seed)
+    episodes = []
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        _, _, _, infos = env.step(rng.integers(0, ACTION_COUNT, args.envs))
+        episodes.extend(info["score"] for info in infos if info)
+    elapsed = time.perf_counter() - start
+    steps = args.steps * args.envs
+    print(f"{steps} env steps in {elapsed:.2f}s: {steps / elapsed:.0f} steps/s "
+          f"({args.envs} envs, frame skip {args.frame_skip}, {len(episodes)} episodes done"
+          + (f", mean score {sum(episodes) / len(episodes):.0f})" if episodes else ")"))
+
+def run_sim(args):
+    # Pure simulation throughput; finished games are replaced with the next seed
+    input_source = INPUT_SOURCES[args.input]
+    profiler = FrameProfiler(args.profile) if args.profile else None
+    games = 1
+    game = Game(headless=True, seed=args.seed, input_source=input_source, profiler=profiler)
+    frames = 0
+    start = time.perf_counter()
+    while frames < args.frames:
+        frames += game.step(args.frames - frames)
+        if game.game_over and frames < args.frames:
+            game = Game(headless=True, seed=args.seed + games, input_source=input_source,
+                        profiler=profiler)
+            games += 1
+    elapsed = time.perf_counter() - start
+    print(f"{frames} frames in {elapsed:.2f}s: {frames / elapsed:.0f} FPS "
+          f"({games} games, last score {game.player.score}, wave {game.wave})")
+    for name, value in game.pool_rows():
+        print(f"  {name:<14}{value}")
+    if profiler is not None:
+        print(profiler.summary())
+        profiler.close()
+
+def run_replay(args):
+    replay = Replay.load(args.file)
+    start = time.perf_counter()
+    if args.realtime:
+        game = Game(seed=replay.seed, input_source=replay.input_source)
+        game.frame_limit = replay.frames
+        game.run()
+    else:
+        # Unthrottled and never drawn
+        game = Game(headless=True, seed=replay.seed, input_source=replay.input_source)
+        game.step(replay.frames)
+    elapsed = time.perf_counter() - start
+    print(f"Replayed {game.frame}/{replay.frames} frames in {elapsed:.2f}s: "
+          f"score {game.player.score} (recorded {replay.score}), "
+          f"wave {game.wave} (recorded {replay.wave})")
+    if not replay.matches(game):
+        print("MISMATCH: replay diverged from the recording")
+        return 1
+    print("OK")
+    return 0
+
+def check_game(seed, collision_mode="grid"):
+    game = Game(headless=True, seed=seed, input_source=autopilot_input)
+    game.collision_mode = collision_mode
+    return game
+
+def run_check(args):
+    # Plays each CHECK_SEEDS game through the optimized paths and their
+    # references and compares the final states as snapshot() blobs: grid
+    # against brute-force collisions, a mid-game snapshot restored into
+    # another Game against the uninterrupted game, and the timer wheel's
+    # results against CHECK_EXPECTED
+    failed = 0
+    for seed in CHECK_SEEDS:
+        game = check_game(seed)
+        game.step(CHECK_SNAPSHOT_AT)
+        saved = game.snapshot()
+        game.step(CHECK_FRAMES)
+        final = game.snapshot()
+        
+        brute = check_game(seed, "brute")
+        brute.step(CHECK_FRAMES)
+        restored = check_game(seed + 1)
+        restored.restore(saved)
+        restored.step(CHECK_FRAMES)
+        
+        checks = (("collisions", brute.snapshot() == final),
+                  ("snapshot", restored.snapshot() == final),
+                  ("timers", (game.frame, game.player.score, game.wave) == CHECK_EXPECTED[seed]))
+        failed += sum(not ok for name, ok in checks)
+        print(f"seed {seed}: frame {game.frame}, score {game.player.score}, wave {game.wave}: " +
+              ", ".join(f"{name} {'ok' if ok else 'MISMATCH'}" for name, ok in checks))
+    if failed:
+        print(f"MISMATCH: {failed} checks failed")
+        return 1
+    print("OK")
+    return 0
+
+# Benchmark scenarios: each is called before every measured frame and tops
+# the scene back up to its load, so kills and culling don't thin it out
+def hold_scene(game, wave):
+    # Keep the player alive and stop the wave logic from moving on
+    player = game.player
+    player.health = player.max_health
+    player.invincible_until = game.frame + 2
+    player.lives = 3
+    game.wave = wave
+    game.next_spawn = game.frame + 1000
+    game.enemies_spawned = game.enemies_to_spawn
+
+def fill_enemies(game, types, count):
+    rng = game.rng
+    while len(game.enemies) < count:
+        i = game.enemies.live
+        enemy = game.enemies.spawn(Enemy, rng.choice(types), rng, game.timers)
+        enemy.x = 40 + (i % 5) * 190
+        enemy.y = 40 + (i // 5) * 80
+        enemy.speed = 0
+        
+def bench_boss_bullets(game):
+    # Wave-5 boss with 1,000 live enemy bullets
+    hold_scene(game, 5)
+    game.boss_wave = True
+    fill_enemies(game, ["boss"], 1)
+    rng = game.rng
+    need = 1000 - len(game.enemy_bullets)
+    if need > 0:
+        angle = np.array([rng.uniform(0, math.tau) for _ in range(need)])
+        x = np.array([rng.uniform(0, SCREEN_WIDTH) for _ in range(need)])
+        y = np.array([rng.uniform(0, SCREEN_HEIGHT) for _ in range(need)])
+        game.enemy_bullets.emit(x, y, np.sin(angle) * 3, np.cos(angle) * 3, "boss")
+                                 
+def bench_tank_spread(game):
+    # 20 tanks under a power-level-3 spread
+    hold_scene(game, 4)
+    game.input_source = lambda game: ACTION_FIRE
+    game.player.power_level = 3
+    game.player.power_until = game.frame + 1000
+    fill_enemies(game, ["tank"], 20)
+    
+def bench_laser_sweep(game):
+    # Laser swept left and right across a full wave
+    hold_scene(game, 8)
+    game.input_source = lambda game: ACTION_FIRE | (ACTION_LEFT if game.frame // 120 % 2 else ACTION_RIGHT)
+    game.player.weapon_type = "laser"
+    game.player.special_ammo = 1000
+    fill_enemies(game, ["basic", "fast", "tank"], 20)
+    
+def bench_particles(game):
+    # 10,000 live particles
+    hold_scene(game, 1)
+    rng = game.rng
+    colors = [RED, PURPLE, ORANGE, YELLOW, CYAN]
+    while len(game.particles) < 10000:
+        game.particles.emit(rng.uniform(0, SCREEN_WIDTH), rng.uniform(0, SCREEN_HEIGHT),
+                            rng.choice(colors), 500)
+                            
+BENCH_SCENARIOS = {
+    "boss_bullets": bench_boss_bullets,
+    "tank_spread": bench_tank_spread,
+    "laser_sweep": bench_laser_sweep,
+    "particles": bench_particles,
+}
+
+def bench_scenario(scenario, mode, frames, warmup, render_scale=1.0, collision_mode=COLLISION_MODE):
+    # FPS of update(), draw() to the offscreen surface, or both, serially or
+    # with drawing on the render thread; only the game's own calls are
+    # timed, not the scenario top-ups
+    game = Game(headless=True, seed=0, pipelined=mode == "pipelined", render_scale=render_scale)
+    game.collision_mode = collision_mode
+    for _ in range(warmup):
+        scenario(game)
+        game.update()
+    elapsed = 0.0
+    for _ in range(frames):
+        scenario(game)
+        start = time.perf_counter()
+        if mode != "draw":
+            game.update()
+        if mode != "update":
+            game.draw()
+        elapsed += time.perf_counter() - start
+    if game.pipeline is not None:
+        start = time.perf_counter()
+        game.pipeline.stop()
+        elapsed += time.perf_counter() - start
+    return frames / elapsed
+
+def compare_bench(baseline, results, threshold):
+    # Print the FPS change per scenario and mode; True if any regressed
+    if baseline.get("frames") != results.get("frames"):
+        print("warning: baseline was measured over a different number of frames")
+    if baseline.get("render_scale", 1.0) != results.get("render_scale", 1.0):
+        print("warning: baseline was drawn at a different render scale")
+    regressed = False
+    for name, modes in results["scenarios"].items():
+        old_modes = baseline["scenarios"].get(name)
+        if old_modes is None:
+            continue
+        for mode, fps in modes.items():
+            old = old_modes.get(mode)
+            if not old:
+                continue
+            change = (fps - old) / old * 100
+            flag = ""
+            if change < -threshold:
+                flag = "  REGRESSION"
+                regressed = True
+            print(f"{name:<14}{mode:<8}{old:10.0f} -> {fps:8.0f} FPS  {change:+6.1f}%{flag}")
+    return regressed
+
+def run_bench(args):
+    names = args.scenario or list(BENCH_SCENARIOS)
+    results = {"frames": args.frames, "warmup": args.warmup, "render_scale": args.render_scale,
+               "collisions": args.collisions, "scenarios": {}}
+    for name in names:
+        modes = {}
+        for mode in ("update", "draw", "full", "pipelined"):
+            modes[mode] = max(bench_scenario(BENCH_SCENARIOS[name], mode, args.frames, args.warmup,
+                                             args.render_scale, args.collisions)
+                              for _ in range(args.repeat))
+        results["scenarios"][name] = modes
+        print(f"{name:<14}update {modes['update']:8.0f}  draw {modes['draw']:8.0f}  "
+              f"full {modes['full']:8.0f}  pipelined {modes['pipelined']:8.0f} FPS")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare_bench(baseline, results, args.threshold):
+            return 1
+    return 0
+
+def run_bench_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        results = json.load(f)
+    return 1 if compare_bench(baseline, results, args.threshold) else 0
+
+# Memory report: one sample entity per class, built from a shared RNG and
+# timer wheel (scheduled timers count towards the entity)
+MEMORY_SAMPLES = {
+    "Player": (Player, lambda cls, rng, timers: cls(timers)),
+    "Bullet": (Bullet, lambda cls, rng, timers: cls(rng.randint(0, SCREEN_WIDTH), rng.randint(0, SCREEN_HEIGHT),
+                                                    -10, GREEN, -5)),
+    "LaserBeam": (LaserBeam, lambda cls, rng, timers: cls(rng.randint(0, SCREEN_WIDTH), SCREEN_HEIGHT - 100)),
+    "Enemy": (Enemy, lambda cls, rng, timers: cls(rng.choice(SPAWN_TYPES), rng, timers)),
+    "PowerUp": (PowerUp, lambda cls, rng, timers: cls(rng.uniform(0, SCREEN_WIDTH), rng.uniform(0, SCREEN_HEIGHT),
+                                                      rng.choice(DROP_TYPES))),
+}
+
+def unslotted(cls):
+    # The same class keeping its fields in a per-instance __dict__, as the
+    # entities did before __slots__: the memory report's reference
+    skip = set(cls.__slots__) | {"__slots__"}
+    return type(cls.__name__, cls.__bases__, {name: value for name, value in vars(cls).items()
+                                              if name not in skip})
+
+class UnkeptTimers(TimerWheel):
+    # Hands back deadlines without storing them, to leave the wheel's own
+    # entries out of an entity's size
+    def schedule(self, frame, owner, event):
+        return frame
+
+def measure_entities(cls, factory, count, timers_class=UnkeptTimers):
+    # Bytes per entity as seen by tracemalloc, and microseconds to build one
+    # (timed separately, as tracing slows allocation down)
+    rng = random.Random(0)
+    timers = timers_class()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    entities = [factory(cls, rng, timers) for _ in range(count)]
+    size = tracemalloc.get_traced_memory()[0] - before - sys.getsizeof(entities)
+    tracemalloc.stop()
+    rng = random.Random(0)
+    timers = timers_class()
+    start = time.perf_counter()
+    entities = [factory(cls, rng, timers) for _ in range(count)]
+    elapsed = time.perf_counter() - start
+    return size / count, elapsed / count * 1e6
+
+def run_memory(args):
+    # Each entity class against an unslotted copy of itself; what it puts on
+    # the timer wheel is listed apart, as it is the same either way
+    print(f"{'entity':<16}{'dict bytes':>12}{'slots bytes':>12}{'saved':>8}{'timers':>8}{'build us':>10}")
+    for name, (cls, factory) in MEMORY_SAMPLES.items():
+        before, _ = measure_entities(unslotted(cls), factory, args.count)
+        size, build = measure_entities(cls, factory, args.count)
+        kept, _ = measure_entities(cls, factory, args.count, TimerWheel)
+        print(f"{name:<16}{before:12.0f}{size:12.0f}{1 - size / before:8.0%}{kept - size:8.0f}{build:10.2f}")
+    for name, engine in (("enemy bullet", BulletField(1)), ("particle", ParticleSystem(1))):
+        size = sum(arr.itemsize for arr in engine.arrays)
+        print(f"{name:<16}{'':>12}{size:12.0f}{'(array)':>8}")
+
+# Startup probe run in a fresh interpreter: times the dependency and module
+# imports, Game() and the first update and draw, in seconds
+STARTUP_PROBE = """
+import importlib.util, json, sys, time
+start = time.perf_counter()
+import numpy, pygame
+deps = time.perf_counter()
+spec = importlib.util.spec_from_file_location("galactic_defender", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+after_import = module.initialized_subsystems()
+game = module.Game(headless=sys.argv[2] == "headless", seed=0)
+created = time.perf_counter()
+game.update()
+game.draw()
+drawn = time.perf_counter()
+print(json.dumps({"deps": deps - start, "module": imported - deps, "init": created - imported,
+                  "first_frame": drawn - created, "after_import": after_import,
+                  "after_frame": module.initialized_subsystems()}))
+"""
+STARTUP_RUNS = 5
+STARTUP_PHASES = ("deps", "module", "init", "first_frame")
+
+def run_startup(args):
+    # Median of several cold starts; windowed runs need a display (or
+    # SDL_VIDEODRIVER=dummy)
+    path = os.path.abspath(__file__)
+    modes = ["headless", "windowed"] if args.windowed else ["headless"]
+    print(f"{'mode':<10}" + "".join(f"{phase + ' ms':>16}" for phase in STARTUP_PHASES) + f"{'total ms':>12}")
+    for mode in modes:
+        runs = []
+        for _ in range(args.runs):
+            out = subprocess.run([sys.executable, "-c", STARTUP_PROBE, path, mode],
+                                 capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(out.splitlines()[-1]))  # pygame prints a banner first
+        medians = [sorted(run[phase] for run in runs)[len(runs) // 2] * 1000 for phase in STARTUP_PHASES]
+        print(f"{mode:<10}" + "".join(f"{ms:16.1f}" for ms in medians) + f"{sum(medians):12.1f}")
+        print(f"{'':<10}initialized after import: {', '.join(runs[-1]['after_import']) or 'nothing'}; "
+              f"after first frame: {', '.join(runs[-1]['after_frame']) or 'nothing'}")
+
+def play_batch_game(job):
+    # Worker: one headless game to game over or the frame cap
+    seed, policy, max_frames = job
+    start = time.perf_counter()
+    game = Game(headless=True, seed=seed, input_source=INPUT_SOURCES[policy])
+    game.step(max_frames)
+    stats = game.stats
+    return {
+        "seed": seed,
+        "policy": policy,
+        "wave": game.wave,
+        "score": game.player.score,
+        "frames": game.frame,
+        "finished": game.game_over,
+        "kills": dict(stats["kills"]),
+        "deaths": dict(stats["deaths"]),
+        "powerups": dict(stats["powerups"]),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+class BatchSummary:
+    # Running totals over finished games
+    def __init__(self):
+        self.games = 0
+        self.finished = 0
+        self.score_total = 0
+        self.best_score = 0
+        self.waves = Counter()
+        self.kills = Counter()
+        self.deaths = Counter()
+        self.powerups = Counter()
+        
+    def add(self, result):
+        self.games += 1
+        self.finished += result["finished"]
+        self.score_total += result["score"]
+        self.best_score = max(self.best_score, result["score"])
+        self.waves[result["wave"]] += 1
+        self.kills.update(result["kills"])
+        self.deaths.update(result["deaths"])
+        self.powerups.update(result["powerups"])
+        
+    def as_dict(self):
+        games = max(self.games, 1)
+        return {
+            "games": self.games,
+            "finished": self.finished,
+            "mean_score": self.score_total / games,
+            "best_score": self.best_score,
+            "mean_wave": sum(wave * n for wave, n in self.waves.items()) / games,
+            "waves": {str(wave): n for wave, n in sorted(self.waves.items())},
+            "kills_per_game": {k: n / games for k, n in sorted(self.kills.items())},
+            "deaths_per_game": {str(k): n / games for k, n in sorted(self.deaths.items(), key=str)},
+            "powerups_per_game": {k: n / games for k, n in sorted(self.powerups.items())},
+        }
+        
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+def run_batch(args):
+    # Games are spread over a process pool; each result is appended to the
+    # JSON lines file and flushed as it arrives, and the summary is
+    # rewritten periodically
+    jobs = [(args.seed + i, args.policy, args.max_frames) for i in range(args.games)]
+    summary_path = args.summary or os.path.splitext(args.out)[0] + ".summary.json"
+    summary = BatchSummary()
+    start = time.perf_counter()
+    with open(args.out, "w") as out, multiprocessing.Pool(args.workers or None) as pool:
+        for result in pool.imap_unordered(play_batch_game, jobs, chunksize=4):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            summary.add(result)
+            if summary.games % BATCH_SUMMARY_EVERY == 0:
+                summary.save(summary_path)
+                print(f"{summary.games}/{args.games} games, "
+                      f"{time.perf_counter() - start:.0f}s elapsed")
+        # Let the workers exit on their own: the SDL signal handlers they
+        # inherit swallow the SIGTERM that terminate() would send
+        pool.close()
+        pool.join()
+    summary.save(summary_path)
+    totals = summary.as_dict()
+    print(f"{summary.games} games in {time.perf_counter() - start:.1f}s: "
+          f"mean wave {totals['mean_wave']:.2f}, mean score {totals['mean_score']:.0f}")
+    print(f"Results in {args.out}, summary in {summary_path}")
+
+# Co-op wire format. Every message is NET_MESSAGE (payload length, type)
+# and its payload. A snapshot is the world as NET_TABLES arrays sorted by
+# entity id (pool serials, enemy bullet ids, seats for players), each
+# column minus the same entity's value in the last snapshot the client
+# acked, zlib-compressed. Enemy bullets go out as where, how fast and when
+# they were fired, which never changes, so a volley is paid for once
+MSG_HELLO = 1  # client: NET_HELLO
+MSG_WELCOME = 2  # server: NET_WELCOME
+MSG_INPUT = 3  # client: NET_INPUT, once per snapshot received
+MSG_SNAPSHOT = 4  # server: NET_SNAPSHOT, then the compressed world
+NET_MESSAGE = struct.Struct("<IB")
+NET_HELLO = struct.Struct("<4sH")  # magic, protocol version
+NET_WELCOME = struct.Struct("<IBQHB")  # session, seat, seed, tick rate, ticks per snapshot
+NET_INPUT = struct.Struct("<IB")  # newest snapshot tick decoded, actions
+NET_SNAPSHOT = struct.Struct("<II")  # tick, base tick (0 for a full snapshot)
+NET_WORLD = struct.Struct("<IH?Q")  # score, wave, game over, enemy bullet clock
+NET_COUNT = struct.Struct("<I")
+NET_TABLES = {
+    "players": np.dtype([("id", "<u4"), ("x", "<i2"), ("y", "<i2"), ("health", "<i2"),
+                         ("lives", "u1"), ("flags", "u1")]),
+    "enemies": np.dtype([("id", "<u4"), ("x", "<i2"), ("y", "<i2"), ("type", "u1"),
+                         ("health", "<i2"), ("flags", "u1")]),
+    "bullets": np.dtype([("id", "<u4"), ("x", "<i2"), ("y", "<i2"), ("kind", "u1")]),
+    "powerups": np.dtype([("id", "<u4"), ("x", "<i2"), ("y", "<i2"), ("type", "u1")]),
+    "enemy_bullets": np.dtype([("id", "<u4"), ("x", "<i2"), ("y", "<i2"), ("dx", "<i2"), ("dy", "<i2"),
+                               ("born", "<u4"), ("type", "u1")]),
+}
+NET_VELOCITY_SCALE = 256  # enemy bullet velocities in 1/256 pixels per tick
+NET_EMPTY = {name: np.empty(0, dtype) for name, dtype in NET_TABLES.items()}
+NET_VISIBLE = 1  # player flags: drawn this frame (blinks while invincible),
+NET_LASER = 2  # laser armed, power level in the bits above
+NET_FLASH = 1  # enemy flags: hit flash
+
+NetWorld = namedtuple("NetWorld", "tick score wave game_over clock tables")
+
+def capture_world(game, tick):
+    # What clients see of the game, positions quantized
+    q = NET_POSITION_SCALE
+    players = [(seat, round(p.x * q), round(p.y * q), p.health, p.lives,
+                (p.invincible <= 0 or p.invincible % 8 < 4) * NET_VISIBLE |
+                (p.weapon_type == "laser") * NET_LASER | p.power_level << 2)
+               for seat, p in enumerate(game.players) if p.lives > 0]
+    enemies = [(e.serial, round(e.x * q), round(e.y * q), ENEMY_TYPE_NAMES.index(e.type),
+                e.health, e.flashing() * NET_FLASH)
+               for e in game.enemies if e.alive]
+    bullets = [(b.serial, round(b.x * q), round(b.y * q), BULLET_KINDS.index(type(b)))
+               for b in game.bullets if b.alive]
+    powerups = [(p.serial, round(p.x * q), round(p.y * q), POWERUP_TYPE_NAMES.index(p.type))
+                for p in game.powerups if p.alive]
+    field = game.enemy_bullets
+    n = field.count
+    enemy_bullets = np.empty(n, NET_TABLES["enemy_bullets"])
+    enemy_bullets["id"] = field.ids[:n]
+    enemy_bullets["x"] = np.rint(field.origin_x[:n] * q)
+    enemy_bullets["y"] = np.rint(field.origin_y[:n] * q)
+    enemy_bullets["dx"] = np.rint(field.dx[:n] * NET_VELOCITY_SCALE)
+    enemy_bullets["dy"] = np.rint(field.dy[:n] * NET_VELOCITY_SCALE)
+    enemy_bullets["born"] = field.born[:n]
+    enemy_bullets["type"] = field.kind[:n]
+    tables = {
+        "players": np.array(players, NET_TABLES["players"]),
+        "enemies": np.array(enemies, NET_TABLES["enemies"]),
+        "bullets": np.array(bullets, NET_TABLES["bullets"]),
+        "powerups": np.array(powerups, NET_TABLES["powerups"]),
+        "enemy_bullets": enemy_bullets,
+    }
+    return NetWorld(tick, game.player.score, game.wave, game.game_over, field.clock, tables)
+
+def match_ids(base, table):
+    # For each record of table, its index in base and whether its id is there
+    if len(base) == 0:
+        return np.zeros(len(table), dtype=np.intp), np.zeros(len(table), dtype=bool)
+    pos = np.minimum(np.searchsorted(base["id"], table["id"]), len(base) - 1)
+    return pos, base["id"][pos] == table["id"]
+
+def delta_table(base, table):
+    # Count, then columns: ids as gaps from the previous id, the other
+    # fields minus the base record with the same id (new ids against zero).
+    # Integer columns wrap, which undelta_table undoes
+    pos, found = match_ids(base, table)
+    columns = [np.diff(table["id"], prepend=np.uint32(0))]
+    for name in table.dtype.names[1:]:
+        column = table[name].copy()
+        column[found] -= base[name][pos[found]]
+        columns.append(column)
+    return NET_COUNT.pack(len(table)) + b"".join(column.tobytes() for column in columns)
+
+def undelta_table(base, dtype, data, offset):
+    (n,) = NET_COUNT.unpack_from(data, offset)
+    offset += NET_COUNT.size
+    table = np.empty(n, dtype)
+    for name in dtype.names:
+        column = dtype[name]
+        table[name] = np.frombuffer(data, column, n, offset)
+        offset += n * column.itemsize
+    table["id"] = np.cumsum(table["id"], dtype=np.uint32)
+    pos, found = match_ids(base, table)
+    for name in dtype.names[1:]:
+        table[name][found] += base[name][pos[found]]
+    return table, offset
+
+def encode_world(world, base=None):
+    # Snapshot body for a client whose newest world is base (None for all of it)
+    parts = [NET_WORLD.pack(world.score, world.wave, world.game_over, world.clock)]
+    for name in NET_TABLES:
+        parts.append(delta_table(base.tables[name] if base else NET_EMPTY[name], world.tables[name]))
+    return zlib.compress(b"".join(parts), NET_ZLIB_LEVEL)
+
+def decode_world(tick, data, base=None):
+    data = zlib.decompress(data)
+    score, wave, game_over, clock = NET_WORLD.unpack_from(data)
+    offset = NET_WORLD.size
+    tables = {}
+    for name, dtype in NET_TABLES.items():
+        tables[name], offset = undelta_table(base.tables[name] if base else NET_EMPTY[name],
+                                             dtype, data, offset)
+    return NetWorld(tick, score, wave, game_over, clock, tables)
+
+def enemy_bullet_positions(world):
+    # Pixel positions of a world's enemy bullets from their firing state
+    table = world.tables["enemy_bullets"]
+    age = world.clock - table["born"]
+    return (table["x"] / NET_POSITION_SCALE + table["dx"] / NET_VELOCITY_SCALE * age,
+            table["y"] / NET_POSITION_SCALE + table["dy"] / NET_VELOCITY_SCALE * age)
+
+def interpolate_world(a, b, alpha):
+    # b with the positions of entities also in a moved alpha of the way from
+    # a (enemy bullets follow the clock)
+    tables = {}
+    for name, table in b.tables.items():
+        base = a.tables[name]
+        pos, found = match_ids(base, table)
+        table = table.copy()
+        for axis in ("x", "y"):
+            start = base[axis][pos[found]].astype(np.float64)
+            table[axis][found] = np.rint(start + (table[axis][found] - start) * alpha)
+        tables[name] = table
+    return b._replace(tick=a.tick + (b.tick - a.tick) * alpha, clock=a.clock + (b.clock - a.clock) * alpha,
+                      tables=tables)
+
+def send_message(writer, kind, payload=b""):
+    writer.write(NET_MESSAGE.pack(len(payload), kind) + payload)
+    
+async def read_message(reader):
+    # (type, payload); EOFError once the other end is gone
+    length, kind = NET_MESSAGE.unpack(await reader.readexactly(NET_MESSAGE.size))
+    return kind, await reader.readexactly(length)
+
+def mean_ms(samples):
+    return sum(samples) / len(samples) * 1000 if samples else 0.0
+
+class CoopSeat:
+    # A client connected to a CoopServer: its held actions, what it has
+    # acked, and lag and bandwidth metrics
+    def __init__(self, writer, session, seat):
+        self.writer = writer
+        self.session = session
+        self.seat = seat
+        self.actions = 0
+        self.shots = 0  # single shots since the last tick
+        self.acked = 0
+        self.sent_at = {}  # snapshot tick -> send time, until acked
+        self.rtt = deque(maxlen=NET_METRIC_WINDOW)
+        self.ack_lag = deque(maxlen=NET_METRIC_WINDOW)  # ticks behind when acking
+        self.joined = time.perf_counter()
+        self.bytes_sent = 0
+        self.snapshots = 0
+        self.full = 0
+        self.skipped = 0
+        self.largest = 0
+        
+    def take_actions(self):
+        # Actions for this tick; a single shot fires once
+        actions = self.actions & ~ACTION_SHOT | self.shots
+        self.shots = 0
+        return actions
+        
+    def receive_input(self, acked, actions):
+        self.actions = actions
+        self.shots |= actions & ACTION_SHOT
+        if acked > self.acked:
+            sent = self.sent_at.pop(acked, None)
+            if sent is not None:
+                self.rtt.append(time.perf_counter() - sent)
+            self.ack_lag.append(self.session.tick - acked)
+            self.acked = acked
+            for tick in [tick for tick in self.sent_at if tick < acked]:
+                del self.sent_at[tick]
+                
+    def send_snapshot(self, world, history, encoded):
+        # Delta against the newest world the client acked, if still in
+        # history; encoded caches bodies by base tick across seats
+        if self.writer.transport.get_write_buffer_size() > NET_MAX_BUFFER:
+            self.skipped += 1
+            return
+        base = history.get(self.acked)
+        base_tick = base.tick if base else 0
+        payload = encoded.get(base_tick)
+        if payload is None:
+            payload = NET_SNAPSHOT.pack(world.tick, base_tick) + encode_world(world, base)
+            encoded[base_tick] = payload
+        send_message(self.writer, MSG_SNAPSHOT, payload)
+        self.sent_at[world.tick] = time.perf_counter()
+        self.snapshots += 1
+        self.full += base is None
+        self.bytes_sent += NET_MESSAGE.size + len(payload)
+        self.largest = max(self.largest, NET_MESSAGE.size + len(payload))
+        
+    def metrics(self):
+        elapsed = max(time.perf_counter() - self.joined, 1e-9)
+        rtt = sorted(self.rtt)
+        return {
+            "rtt_ms": mean_ms(rtt),
+            "rtt_p95_ms": rtt[int(len(rtt) * 0.95)] * 1000 if rtt else 0.0,
+            "ack_lag_ticks": sum(self.ack_lag) / len(self.ack_lag) if self.ack_lag else 0.0,
+            "snapshots": self.snapshots,
+            "full": self.full,
+            "skipped": self.skipped,
+            "bytes_per_s": self.bytes_sent / elapsed,
+            "mean_bytes": self.bytes_sent / self.snapshots if self.snapshots else 0.0,
+            "largest_bytes": self.largest,
+        }
+
+class CoopSession:
+    # One authoritative co-op game run at SIM_RATE ticks a second. Seats
+    # hold actions that feed the players; every NET_SEND_EVERY ticks each
+    # seat gets a delta snapshot
+    def __init__(self, number, seed, start_wave=1):
+        self.number = number
+        self.seed = seed
+        self.game = Game(headless=True, seed=seed, players=COOP_PLAYERS, input_source=self.seat_input)
+        if start_wave > 1:
+            game = self.game
+            game.wave = start_wave
+            game.enemies_to_spawn = min(20, 5 + start_wave * 2)
+            game.initial_state = game.snapshot()
+        self.seats = [None] * COOP_PLAYERS
+        self.tick = 0
+        self.over_at = None  # tick the game ended
+        self.history = {}  # tick -> NetWorld sent, for delta bases
+        self.tick_time = deque(maxlen=NET_METRIC_WINDOW)
+        self.late_ticks = 0
+        
+    def seat_input(self, game):
+        # input_source for the first player; the rest go to partner_actions
+        actions = [seat.take_actions() if seat else 0 for seat in self.seats]
+        game.partner_actions[:] = actions[1:]
+        return actions[0]
+        
+    def step(self):
+        game = self.game
+        if game.game_over:
+            if self.over_at is None:
+                self.over_at = self.tick
+            elif self.tick - self.over_at >= NET_RESTART_DELAY * SIM_RATE:
+                game.restart()
+                self.over_at = None
+        else:
+            game.update()
+        self.tick += 1
+        if self.tick % NET_SEND_EVERY == 0:
+            world = capture_world(game, self.tick)
+            self.history[self.tick] = world
+            self.history.pop(self.tick - NET_HISTORY * NET_SEND_EVERY, None)
+            encoded = {}
+            for seat in self.seats:
+                if seat is not None:
+                    seat.send_snapshot(world, self.history, encoded)
+                    
+    async def run(self):
+        # Fixed-rate ticks until the last seat leaves; a tick that starts
+        # late counts as late, and after MAX_CATCH_UP of them the schedule
+        # restarts from now
+        import asyncio
+        loop = asyncio.get_running_loop()
+        period = 1 / SIM_RATE
+        due = loop.time()
+        while any(self.seats):
+            start = time.perf_counter()
+            self.step()
+            self.tick_time.append(time.perf_counter() - start)
+            due += period
+            delay = due - loop.time()
+            if delay < 0:
+                self.late_ticks += 1
+                if delay < -MAX_CATCH_UP * period:
+                    due = loop.time()
+            await asyncio.sleep(max(0.0, delay))
+            
+    def report(self):
+        game = self.game
+        lines = [f"session {self.number}: tick {self.tick}, wave {game.wave}, score {game.player.score}, "
+                 f"tick {mean_ms(self.tick_time):.2f} ms, {self.late_ticks} late"]
+        for seat in self.seats:
+            if seat is None:
+                continue
+            m = seat.metrics()
+            budget = "ok" if m["bytes_per_s"] <= NET_BUDGET else "OVER BUDGET"
+            lines.append(f"  seat {seat.seat}: rtt {m['rtt_ms']:.1f} ms (p95 {m['rtt_p95_ms']:.1f}), "
+                         f"ack lag {m['ack_lag_ticks']:.1f} ticks, {m['snapshots']} snapshots "
+                         f"({m['full']} full, {m['skipped']} skipped), {m['mean_bytes']:.0f} B mean, "
+                         f"{m['largest_bytes']} B largest, {m['bytes_per_s'] / 1024:.1f} KiB/s {budget}")
+        return lines
+
+class CoopServer:
+    # Any number of CoopSessions on one asyncio loop; a client joins the
+    # first session with a free seat, or starts a new one
+    def __init__(self, seed=0, start_wave=1):
+        self.seed = seed
+        self.start_wave = start_wave
+        self.sessions = []
+        self.started = 0
+        self.server = None
+        
+    async def start(self, host="127.0.0.1", port=NET_PORT):
+        # Returns the port, which is picked by the OS for port 0
+        import asyncio
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+        
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        
+    def join(self, writer):
+        import asyncio
+        for session in self.sessions:
+            if None in session.seats:
+                break
+        else:
+            session = CoopSession(self.started, self.seed + self.started, self.start_wave)
+            self.started += 1
+            self.sessions.append(session)
+            task = asyncio.ensure_future(session.run())
+            task.add_done_callback(lambda task: self.sessions.remove(session))
+        index = session.seats.index(None)
+        seat = session.seats[index] = CoopSeat(writer, session, index)
+        return seat
+        
+    async def handle(self, reader, writer):
+        seat = None
+        try:
+            kind, payload = await read_message(reader)
+            if kind != MSG_HELLO or NET_HELLO.unpack(payload) != (NET_MAGIC, NET_VERSION):
+                return
+            seat = self.join(writer)
+            session = seat.session
+            send_message(writer, MSG_WELCOME, NET_WELCOME.pack(session.number, seat.seat, session.seed,
+                                                               SIM_RATE, NET_SEND_EVERY))
+            while True:
+                kind, payload = await read_message(reader)
+                if kind == MSG_INPUT:
+                    seat.receive_input(*NET_INPUT.unpack(payload))
+        except (EOFError, ConnectionError, struct.error):
+            pass
+        finally:
+            if seat is not None:
+                seat.session.seats[seat.seat] = None
+            writer.close()
+            
+    def report(self):
+        lines = []
+        for session in self.sessions:
+            lines.extend(session.report())
+        return lines or ["no sessions"]
+
+class CoopClient:
+    # Connects to a CoopServer, decodes snapshots against the worlds it
+    # acked and answers each with its actions. view() interpolates the
+    # world NET_INTERP_DELAY behind the server for drawing
+    def __init__(self, input_source=None):
+        # input_source(client) gives the actions; without one they come
+        # from actions and shots, set by the caller
+        self.input_source = input_source
+        self.actions = 0
+        self.shots = 0
+        self.reader = None
+        self.writer = None
+        self.session = self.seat = self.seed = None
+        self.tick_rate = SIM_RATE
+        self.send_every = NET_SEND_EVERY
+        self.worlds = {}  # tick -> NetWorld, delta bases and interpolation
+        self.ticks = deque()  # worlds in tick order
+        self.latest = None
+        self.clock = None  # server seconds minus local seconds, smoothed
+        self.received = 0
+        self.full = 0
+        self.bytes_received = 0
+        self.views = 0
+        self.starved = 0  # views with nothing newer to interpolate towards
+        
+    async def connect(self, host="127.0.0.1", port=NET_PORT):
+        import asyncio
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        send_message(self.writer, MSG_HELLO, NET_HELLO.pack(NET_MAGIC, NET_VERSION))
+        kind, payload = await read_message(self.reader)
+        if kind != MSG_WELCOME:
+            raise ConnectionError("server did not welcome us")
+        self.session, self.seat, self.seed, self.tick_rate, self.send_every = NET_WELCOME.unpack(payload)
+        
+    async def run(self):
+        # Until the server goes away or close()
+        try:
+            while True:
+                kind, payload = await read_message(self.reader)
+                if kind == MSG_SNAPSHOT:
+                    self.receive(payload)
+        except (EOFError, ConnectionError):
+            pass
+            
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            
+    def receive(self, payload):
+        tick, base_tick = NET_SNAPSHOT.unpack_from(payload)
+        base = self.worlds.get(base_tick) if base_tick else None
+        if base_tick and base is None:
+            raise ConnectionError(f"snapshot {tick} is against unknown tick {base_tick}")
+        world = decode_world(tick, payload[NET_SNAPSHOT.size:], base)
+        self.worlds[tick] = world
+        self.ticks.append(tick)
+        while len(self.ticks) > NET_HISTORY * 2:
+            del self.worlds[self.ticks.popleft()]
+        self.latest = world
+        self.received += 1
+        self.full += not base_tick
+        self.bytes_received += NET_MESSAGE.size + len(payload)
+        
+        offset = tick / self.tick_rate - time.perf_counter()
+        self.clock = offset if self.clock is None else self.clock + (offset - self.clock) * 0.1
+        
+        if self.input_source is not None:
+            actions = self.input_source(self)
+        else:
+            actions = self.actions & ~ACTION_SHOT | self.shots
+            self.shots = 0
+        send_message(self.writer, MSG_INPUT, NET_INPUT.pack(tick, actions))
+        
+    def view(self, now=None):
+        # The world at NET_INTERP_DELAY behind the server clock, blended
+        # between the snapshots either side; None before the first one
+        if self.latest is None:
+            return None
+        self.views += 1
+        now = time.perf_counter() if now is None else now
+        tick = (now + self.clock - NET_INTERP_DELAY) * self.tick_rate
+        ticks = self.ticks
+        if tick >= ticks[-1]:
+            self.starved += 1
+            return self.latest
+        if tick <= ticks[0]:
+            return self.worlds[ticks[0]]
+        newer = next(t for t in reversed(ticks) if t <= tick)
+        after = ticks[ticks.index(newer) + 1]
+        return interpolate_world(self.worlds[newer], self.worlds[after], (tick - newer) / (after - newer))
+        
+    def metrics(self):
+        return {
+            "snapshots": self.received,
+            "full": self.full,
+            "bytes": self.bytes_received,
+            "starved": self.starved / self.views if self.views else 0.0,
+        }
+
+def coop_bot_input(client):
+    # autopilot_input over the client's newest world
+    world = client.latest
+    q = NET_POSITION_SCALE
+    players = world.tables["players"]
+    me = players[players["id"] == client.seat]
+    if len(me) == 0:
+        return 0
+    enemies = world.tables["enemies"]
+    actions = ACTION_FIRE
+    if len(enemies):
+        target = enemies[np.argmax(enemies["y"])]
+        center = int(me["x"][0]) + 25 * q
+        goal = int(target["x"]) + ENEMY_TYPES[ENEMY_TYPE_NAMES[target["type"]]].width // 2 * q
+        if goal < center - 8 * q:
+            actions |= ACTION_LEFT
+        elif goal > center + 8 * q:
+            actions |= ACTION_RIGHT
+    return actions
+
+class WorldRenderer:
+    # Draws NetWorld views with the game's own sprites, rendered from one
+    # stand-in entity per look, under a local starfield
+    def __init__(self, seed):
+        timers = TimerWheel()
+        rng = random.Random(0)
+        self.sprites = sprite_cache(1.0)
+        self.players = [Player(timers, seat) for seat in range(len(PLAYER_COLORS))]
+        self.enemies = {}
+        for name in ENEMY_TYPE_NAMES:
+            for flash in (False, True):
+                enemy = Enemy(name, rng, timers)
+                enemy.flash_until = timers.now + flash
+                self.enemies[ENEMY_TYPE_NAMES.index(name), flash] = enemy
+        self.bullet = Bullet(0, 0, -10, GREEN)
+        self.powerups = [PowerUp(0, 0, name) for name in POWERUP_TYPE_NAMES]
+        self.enemy_bullets = BulletField().render_sprites(1.0)
+        self.starfield = Starfield(random.Random(seed))
+        self.hud = HUD()
+        
+    def draw(self, screen, world, seat):
+        self.starfield.update()
+        screen.fill(BLACK)
+        self.starfield.draw(screen)
+        if world is None:
+            text = self.hud.text("waiting", load_font(36), "Waiting for the server...", WHITE)
+            screen.blit(text, (SCREEN_WIDTH//2 - text.get_width()//2, SCREEN_HEIGHT//2))
+            return
+        q = NET_POSITION_SCALE
+        sprites = self.sprites
+        tables = world.tables
+        batch = []
+        shapes = []
+        for row in tables["bullets"].tolist():
+            _, x, y, kind = row
+            if BULLET_KINDS[kind] is LaserBeam:
+                shapes.append((YELLOW, (x / q, 0, LaserBeam.width, y / q)))
+            else:
+                batch.append((sprites.get(self.bullet), (x / q, y / q)))
+        xs, ys = enemy_bullet_positions(world)
+        kinds = self.enemy_bullets[tables["enemy_bullets"]["type"]]
+        batch.extend(zip(kinds.tolist(), zip(xs.astype(np.intp).tolist(), ys.astype(np.intp).tolist())))
+        for _, x, y, kind, health, flags in tables["enemies"].tolist():
+            enemy = self.enemies[kind, bool(flags & NET_FLASH)]
+            batch.append((sprites.get(enemy), (x / q, y / q)))
+            if ENEMY_TYPE_NAMES[kind] == "boss":
+                enemy.x, enemy.y, enemy.health = x / q, y / q, health
+                shapes.extend(enemy.health_bar())
+        for _, x, y, kind in tables["powerups"].tolist():
+            powerup = self.powerups[kind]
+            ox, oy = powerup.sprite_offset
+            batch.append((sprites.get(powerup), (x / q + ox, y / q + oy)))
+        for number, x, y, health, lives, flags in tables["players"].tolist():
+            player = self.players[number]
+            player.x, player.y, player.health = x / q, y / q, health
+            if flags & NET_VISIBLE:
+                batch.append((sprites.get(player), (player.x, player.y)))
+            _, bars = player.frame_parts(sprites)
+            shapes.extend(bars)
+        fill_shapes(screen, shapes)
+        blit_batch(screen, batch)
+        
+        hud = self.hud
+        font = load_font(36)
+        labels = [(hud.text("score", font, f"Score: {world.score}", WHITE), (10, 10)),
+                  (hud.text("wave", font, f"Wave: {world.wave}", WHITE), (10, 50))]
+        me = tables["players"][tables["players"]["id"] == seat]
+        lives = int(me["lives"][0]) if len(me) else 0
+        labels.append((hud.text("lives", font, f"Lives: {lives}", WHITE), (SCREEN_WIDTH - 120, 10)))
+        screen.blits(labels, doreturn=False)
+        if world.game_over:
+            text = hud.text("game_over", load_font(48), "GAME OVER", RED)
+            screen.blit(text, (SCREEN_WIDTH//2 - text.get_width()//2, SCREEN_HEIGHT//2 - 50))
+
+async def serve_coop(args):
+    import asyncio
+    server = CoopServer(seed=args.seed, start_wave=args.wave)
+    port = await server.start(args.host, args.port)
+    print(f"co-op server on {args.host}:{port}")
+    while True:
+        await asyncio.sleep(NET_REPORT_EVERY)
+        for line in server.report():
+            print(line)
+
+def run_serve(args):
+    import asyncio
+    try:
+        asyncio.run(serve_coop(args))
+    except KeyboardInterrupt:
+        pass
+
+async def join_coop(args):
+    # Windowed client: keyboard in, interpolated world out
+    import asyncio
+    client = CoopClient()
+    await client.connect(args.host, args.port)
+    receiving = asyncio.ensure_future(client.run())
+    pygame.display.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption(f"Galactic Defender co-op (session {client.session}, seat {client.seat})")
+    renderer = WorldRenderer(client.seed)
+    running = True
+    while running and not receiving.done():
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    running = False
+                elif event.key == pygame.K_z:
+                    client.shots |= ACTION_SHOT
+        client.actions = keyboard_input(None)
+        renderer.draw(screen, client.view(), client.seat)
+        pygame.display.flip()
+        await asyncio.sleep(1 / FPS)
+    client.close()
+    quit_pygame()
+
+def run_join(args):
+    import asyncio
+    asyncio.run(join_coop(args))
+
+async def coop_bots(args):
+    # A server and bot clients on localhost; the bots play for a while and
+    # view their worlds at the draw rate, then both sides report
+    import asyncio
+    server = CoopServer(seed=args.seed, start_wave=args.wave)
+    port = await server.start(args.host, 0)
+    clients = []
+    for _ in range(args.clients):
+        client = CoopClient(coop_bot_input)
+        await client.connect(args.host, port)
+        clients.append(client)
+    receiving = [asyncio.ensure_future(client.run()) for client in clients]
+    end = time.perf_counter() + args.seconds
+    while time.perf_counter() < end:
+        for client in clients:
+            client.view()
+        await asyncio.sleep(1 / FPS)
+    lines = server.report()
+    for client in clients:
+        client.close()
+    await asyncio.gather(*receiving)
+    await server.close()
+    for line in lines:
+        print(line)
+    for client in clients:
+        m = client.metrics()
+        print(f"client session {client.session} seat {client.seat}: {m['snapshots']} snapshots "
+              f"({m['full']} full), {m['bytes'] / 1024:.0f} KiB, starved {m['starved'] * 100:.1f}% of views")
+
+def run_coop_bots(args):
+    import asyncio
+    asyncio.run(coop_bots(args))
+
+def pixel_size(text):
+    # "1280x720" for --window and env --obs-size
+    try:
+        width, height = (int(part) for part in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    if width < 1 or height < 1:
+        raise argparse.ArgumentTypeError(f"size must be positive, got {text!r}")
+    return width, height
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Galactic Defender")
+    parser.add_argument("--seed", type=int,
+                        help="seed for gameplay randomness; batch games and served sessions count up "
+                             "from it (default random for a played game, 0 for commands)")
+    parser.add_argument("--sim-rate", type=int, default=SIM_RATE,
+                        help="simulation ticks per second; the game runs at the same speed, in finer "
+                             "or coarser steps")
+    parser.add_argument("--fps", type=int, default=FPS, help="draw rate cap (0 for uncapped)")
+    parser.add_argument("--no-interpolation", action="store_true",
+                        help="draw the latest tick instead of blending between ticks")
+    parser.add_argument("--stars", type=int, default=STAR_COUNT, help="background star count")
+    parser.add_argument("--render", choices=["full", "dirty"], default="full",
+                        help="present the whole screen or only changed rects")
+    parser.add_argument("--record", metavar="FILE", help="record the seed and inputs of the first game")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="draw on a render thread while the next frame simulates")
+    parser.add_argument("--quality", choices=["auto"] + QUALITY_NAMES, default="auto",
+                        help="cosmetic quality level, or adapt it to the frame budget")
+    parser.add_argument("--render-scale", type=float, default=1.0,
+                        help="internal resolution as a share of 1000x700, e.g. 0.5 or 0.25; "
+                             "also what bench and env pixel observations draw at")
+    parser.add_argument("--window", type=pixel_size, metavar="WxH",
+                        help="window size; the frame is scaled to fit (default 1000x700)")
+    parser.add_argument("--smooth", action="store_true",
+                        help="smooth the upscale instead of keeping hard pixels")
+    parser.add_argument("--capture", metavar="DIR",
+                        help="record gameplay video to DIR (F9 saves the last 30 seconds as a clip)")
+    parser.add_argument("--capture-format", choices=["zlib", "png"], default="zlib",
+                        help="one zlib-compressed capture file, or a PNG per frame")
+    parser.add_argument("--capture-scale", type=float, default=CAPTURE_SCALE,
+                        help="captured frame size as a share of the drawn frame")
+    parser.add_argument("--capture-every", type=int, default=CAPTURE_EVERY,
+                        help="presented frames per captured frame")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="stream per-frame phase timings of the game or sim to FILE "
+                             "(.csv, otherwise JSON lines)")
+    commands = parser.add_subparsers(dest="command")
+    
+    sim = commands.add_parser("sim", help="step headless games at full speed and report FPS")
+    sim.add_argument("--frames", type=int, default=20000)
+    sim.add_argument("--input", choices=sorted(INPUT_SOURCES), default="autopilot")
+    
+    replay = commands.add_parser("replay", help="re-run a recording and check its final score and wave")
+    replay.add_argument("file")
+    replay.add_argument("--realtime", action="store_true",
+                        help="play it back in a window instead of at full speed")
+    
+    commands.add_parser("check", help="play fixed seeds through the fast paths and their references "
+                                      "and compare the final states")
+    
+    bench = commands.add_parser("bench", help="measure update, draw and full-frame FPS of stress scenarios")
+    bench.add_argument("--scenario", action="append", choices=sorted(BENCH_SCENARIOS),
+                       help="run only this scenario (repeatable)")
+    bench.add_argument("--frames", type=int, default=BENCH_FRAMES, help="measured frames per mode")
+    bench.add_argument("--warmup", type=int, default=BENCH_WARMUP)
+    bench.add_argument("--repeat", type=int, default=BENCH_REPEAT, help="report the best of this many runs")
+    bench.add_argument("--collisions", choices=COLLISION_MODES, default=COLLISION_MODE,
+                       help="collision broad phase to measure")
+    bench.add_argument("--save", metavar="FILE", help="write the results as a JSON baseline")
+    bench.add_argument("--compare", metavar="BASELINE", help="flag regressions against a saved baseline")
+    bench.add_argument("--threshold", type=float, default=BENCH_THRESHOLD,
+                       help="FPS drop in percent counted as a regression")
+    
+    bench_compare = commands.add_parser("bench-compare", help="compare two saved benchmark results")
+    bench_compare.add_argument("baseline")
+    bench_compare.add_argument("results")
+    bench_compare.add_argument("--threshold", type=float, default=BENCH_THRESHOLD)
+    
+    batch = commands.add_parser("batch", help="play many seeded headless games across all CPU cores")
+    batch.add_argument("--games", type=int, default=1000)
+    batch.add_argument("--policy", choices=sorted(INPUT_SOURCES), default="autopilot",
+                       help="bot driving every game")
+    batch.add_argument("--workers", type=int, default=0, help="worker processes (0 for one per core)")
+    batch.add_argument("--max-frames", type=int, default=BATCH_MAX_FRAMES)
+    batch.add_argument("--out", default="batch.jsonl", help="per-game results, one JSON object per line")
+    batch.add_argument("--summary", metavar="FILE", help="aggregate statistics (default: next to --out)")
+    
+    env = commands.add_parser("env", help="step vectorized training environments with random actions")
+    env.add_argument("--envs", type=int, default=16)
+    env.add_argument("--steps", type=int, default=2000, help="steps of every environment")
+    env.add_argument("--frame-skip", type=int, default=1, help="frames each action is held for")
+    env.add_argument("--pixels", choices=["gray", "rgb"], help="observe rendered frames instead of features")
+    env.add_argument("--obs-size", type=pixel_size, metavar="WxH",
+                     default=(PIXEL_OBS_WIDTH, PIXEL_OBS_HEIGHT),
+                     help=f"pixel observation size (default {PIXEL_OBS_WIDTH}x{PIXEL_OBS_HEIGHT})")
+    
+    memory = commands.add_parser("memory", help="report bytes per entity with and without __slots__, and build time")
+    memory.add_argument("--count", type=int, default=10000, help="entities built per class")
+    
+    serve = commands.add_parser("serve", help="host co-op games for join clients")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=NET_PORT)
+    serve.add_argument("--wave", type=int, default=1, help="wave sessions start (and restart) at")
+    
+    join = commands.add_parser("join", help="play co-op on a server")
+    join.add_argument("--host", default="127.0.0.1")
+    join.add_argument("--port", type=int, default=NET_PORT)
+    
+    export = commands.add_parser("capture-export", help="write a zlib capture file out as PNG frames")
+    export.add_argument("file")
+    export.add_argument("out", help="folder for the PNGs")
+    
+    bots = commands.add_parser("coop-bots",
+                               help="run a co-op server and bot clients on localhost; report lag and bandwidth")
+    bots.add_argument("--clients", type=int, default=4)
+    bots.add_argument("--seconds", type=float, default=20.0)
+    bots.add_argument("--wave", type=int, default=1, help="wave sessions start at (5 for a boss)")
+    bots.add_argument("--host", default="127.0.0.1")
+    
+    startup = commands.add_parser("startup", help="time module import, Game() and the first frame")
+    startup.add_argument("--runs", type=int, default=STARTUP_RUNS, help="cold starts per mode")
+    startup.add_argument("--windowed", action="store_true", help="also time a windowed game")
+    
+    args = parser.parse_args(argv)
+    if args.seed is None and args.command is not None:
+        args.seed = 0  # commands are reproducible unless asked otherwise
+    if not 0 < args.render_scale <= 1:
+        parser.error("--render-scale must be in (0, 1]")
+    if not 0 < args.capture_scale <= 1 or args.capture_every < 1:
+        parser.error("--capture-scale must be in (0, 1] and --capture-every at least 1")
+    if args.sim_rate < 1 or (args.record and args.sim_rate != SIM_RATE):
+        parser.error("--sim-rate must be positive, and the default with --record")
+    if args.command is None and args.render == "dirty" and (args.render_scale != 1 or args.window):
+        parser.error("--render dirty needs the default --render-scale and --window")
+    if args.command == "sim":
+        run_sim(args)
+    elif args.command == "replay":
+        return run_replay(args)
+    elif args.command == "check":
+        return run_check(args)
+    elif args.command == "bench":
+        return run_bench(args)
+    elif args.command == "bench-compare":
+        return run_bench_compare(args)
+    elif args.command == "batch":
+        run_batch(args)
+    elif args.command == "memory":
+        run_memory(args)
+    elif args.command == "env":
+        run_env(args)
+    elif args.command == "startup":
+        run_startup(args)
+    elif args.command == "serve":
+        run_serve(args)
+    elif args.command == "join":
+        run_join(args)
+    elif args.command == "coop-bots":
+        run_coop_bots(args)
+    elif args.command == "capture-export":
+        run_capture_export(args)
+    else:
+        game = Game(seed=args.seed, sim_rate=args.sim_rate, draw_fps=args.fps,
+                    interpolate=not args.no_interpolation, star_count=args.stars,
+                    render_mode=args.render, record_path=args.record, pipelined=args.pipeline,
+                    profiler=FrameProfiler(args.profile) if args.profile else None,
+                    quality=args.quality, render_scale=args.render_scale, window_size=args.window,
+                    smooth=args.smooth,
+                    capture=FrameCapture(args.capture, args.capture_format, args.capture_scale,
+                                         args.capture_every) if args.capture else None)
+        game.run()
+    return 0
 
 if __name__ == "__main__":
-    game = Game()
-    game.run()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file